@@ -0,0 +1,85 @@
+import asyncio
+import os
+import secrets
+from typing import List, Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from conversations import load_stats
+from database import get_read_db, slow_query_log
+from maintenance import last_results, manage_partitions, purge_expired, rebuild_conversation_stats
+
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+STATS_BULK_MAX_USERS = int(os.getenv("STATS_BULK_MAX_USERS", "1000"))
+
+# Keeps background jobs referenced until they finish
+_background_jobs = set()
+
+
+def require_admin(x_admin_key: str = Header(default="")):
+    """Admin dependency checking the X-Admin-Key header against ADMIN_API_KEY"""
+    # Admin endpoints are disabled entirely when no key is configured
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(x_admin_key, ADMIN_API_KEY):
+        raise HTTPException(status_code=403, detail="Invalid admin key")
+
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/slow-queries")
+async def get_slow_queries(limit: int = Query(50, ge=1, le=1000)):
+    """Most recent slow queries with their captured plans"""
+    return {
+        "threshold_ms": slow_query_log.threshold * 1000,
+        "queries": slow_query_log.recent(limit),
+    }
+
+
+@router.get("/maintenance")
+async def get_maintenance_results():
+    """Results of the last maintenance runs on this replica"""
+    return last_results
+
+
+@router.post("/maintenance/purge")
+async def run_purge_expired():
+    """Purge expired sessions and verification tokens now"""
+    purged = await run_in_threadpool(purge_expired)
+    if purged is None:
+        raise HTTPException(status_code=409, detail="Purge already running on another replica")
+    return {"rows_purged": purged}
+
+
+@router.post("/maintenance/partitions")
+async def run_manage_partitions():
+    """Create upcoming ConversationMessage partitions and retire expired ones now"""
+    changed = await run_in_threadpool(manage_partitions)
+    if changed is None:
+        raise HTTPException(status_code=409, detail="Partition maintenance already running on another replica")
+    return changed
+
+
+@router.post("/maintenance/conversation-stats", status_code=202)
+async def run_rebuild_conversation_stats(after: Optional[UUID] = Body(None, embed=True)):
+    """Start recounting ConversationStats in the background; progress shows in /admin/maintenance"""
+    job = asyncio.create_task(run_in_threadpool(rebuild_conversation_stats, str(after) if after else None))
+    _background_jobs.add(job)
+    job.add_done_callback(_background_jobs.discard)
+    return {"started": True}
+
+
+@router.post("/users/stats")
+def get_users_stats(
+    user_ids: List[UUID] = Body(..., embed=True, alias="userIds", min_length=1, max_length=STATS_BULK_MAX_USERS),
+    db: Session = Depends(get_read_db),
+):
+    """Conversation stats for many users in one primary-key lookup, for dashboards"""
+    try:
+        return {"stats": load_stats(db, [str(user_id) for user_id in user_ids])}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -0,0 +1,377 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import secrets
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal
+from metrics import (admission_active, admission_deferrals_total, admission_queue_depth, admission_rejections_total,
+                     admission_shared_failures_total)
+from python_utils.sqlalchemy_models import RateLimitCounter
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+ADMISSION_MAX_QUEUE_WAIT_MS = int(os.getenv("ADMISSION_MAX_QUEUE_WAIT_MS", "2000"))
+ADMISSION_MIN_SERVICE_MS = int(os.getenv("ADMISSION_MIN_SERVICE_MS", "500"))
+ADMISSION_USER_RPM = float(os.getenv("ADMISSION_USER_RPM", "30"))
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "10"))
+ADMISSION_USER_TPM = float(os.getenv("ADMISSION_USER_TPM", "60000"))
+ADMISSION_GLOBAL_RPM = float(os.getenv("ADMISSION_GLOBAL_RPM", "600"))
+ADMISSION_GLOBAL_TPM = float(os.getenv("ADMISSION_GLOBAL_TPM", "1000000"))
+ADMISSION_EXPECTED_OUTPUT_TOKENS = int(os.getenv("ADMISSION_EXPECTED_OUTPUT_TOKENS", "512"))
+ADMISSION_MAX_TRACKED_USERS = int(os.getenv("ADMISSION_MAX_TRACKED_USERS", "10000"))
+ADMISSION_SHARED_COUNTER = os.getenv("ADMISSION_SHARED_COUNTER", "false").lower() == "true"
+ADMISSION_SHARED_LEASE = int(os.getenv("ADMISSION_SHARED_LEASE", "10"))
+ADMISSION_SHARED_RETRY_S = float(os.getenv("ADMISSION_SHARED_RETRY_S", "5"))
+
+# Callers presenting either secret may ask for high priority
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+ADMISSION_INTERNAL_TOKEN = os.getenv("ADMISSION_INTERNAL_TOKEN")
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't be admitted; carries the Retry-After hint in seconds"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def estimate_tokens(prompt: str) -> int:
+    """Rough token estimate: ~4 characters per prompt token plus the expected output size"""
+    return len(prompt) // 4 + ADMISSION_EXPECTED_OUTPUT_TOKENS
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate`` tokens per second up to ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: Optional[float] = None) -> float:
+        """Seconds until ``amount`` tokens are available, 0 if they are available now"""
+        self._refill(time.monotonic() if now is None else now)
+        # Requests larger than the bucket are admitted once it is full rather than never
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class SharedWindowCounter:
+    """
+    Per-minute request budget shared by all replicas through ``RateLimitCounter``.
+
+    Replicas lease blocks of ``lease_size`` requests with a single upsert, so
+    the database sees one round trip per block rather than per request. If the
+    database is unavailable it fails open for ``ADMISSION_SHARED_RETRY_S``,
+    leaving the local limits in force.
+    """
+
+    def __init__(self, key: str, limit_per_minute: int, lease_size: int = ADMISSION_SHARED_LEASE):
+        self.key = key
+        self.limit = limit_per_minute
+        self.lease_size = lease_size
+        self.window: Optional[datetime] = None
+        self.leased = 0
+        self._retry_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _current_window() -> datetime:
+        return datetime.now(timezone.utc).replace(second=0, microsecond=0, tzinfo=None)
+
+    def _lease(self, window: datetime) -> int:
+        stmt = insert(RateLimitCounter).values(key=self.key, windowStart=window, count=self.lease_size)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RateLimitCounter.key, RateLimitCounter.windowStart],
+            set_={"count": RateLimitCounter.count + stmt.excluded.count},
+        ).returning(RateLimitCounter.count)
+        with SessionLocal() as db:
+            total = db.execute(stmt).scalar_one()
+            if window.minute == 0:
+                # Old windows are useless once the minute has passed, trim them hourly
+                db.query(RateLimitCounter).filter(
+                    RateLimitCounter.key == self.key,
+                    RateLimitCounter.windowStart < window - timedelta(hours=1),
+                ).delete(synchronize_session=False)
+            db.commit()
+        previous = total - self.lease_size
+        return max(0, min(self.lease_size, self.limit - previous))
+
+    async def try_acquire(self) -> Tuple[bool, float]:
+        async with self._lock:
+            window = self._current_window()
+            if window != self.window:
+                self.window = window
+                self.leased = 0
+            if self.leased == 0:
+                if time.monotonic() < self._retry_at:
+                    return True, 0.0
+                try:
+                    self.leased = await run_in_threadpool(self._lease, window)
+                except SQLAlchemyError as e:
+                    # An outage of the shared budget must not take the Gemini endpoints down with it
+                    admission_shared_failures_total.inc()
+                    logger.warning(f"Shared rate limit unavailable, using local limits only: {e}")
+                    self._retry_at = time.monotonic() + ADMISSION_SHARED_RETRY_S
+                    return True, 0.0
+            if self.leased > 0:
+                self.leased -= 1
+                return True, 0.0
+        retry_after = 60 - datetime.now(timezone.utc).second
+        return False, retry_after
+
+
+class AdmissionController:
+    """
+    Admission control in front of the Gemini call path.
+
+    Requests must pass per-user and global token buckets (request count and
+    estimated tokens), then take one of ``max_concurrent`` slots. When all
+    slots are busy they wait in a short priority queue ordered by priority and
+    then deadline; requests whose deadline can't be met are rejected at once
+    rather than queued. Everything runs on the event loop, so no locks are needed.
+    """
+
+    def __init__(self,
+                 max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+                 queue_size: int = ADMISSION_QUEUE_SIZE,
+                 max_queue_wait: float = ADMISSION_MAX_QUEUE_WAIT_MS / 1000,
+                 min_service_time: float = ADMISSION_MIN_SERVICE_MS / 1000,
+                 user_rpm: float = ADMISSION_USER_RPM,
+                 user_burst: float = ADMISSION_USER_BURST,
+                 user_tpm: float = ADMISSION_USER_TPM,
+                 global_rpm: float = ADMISSION_GLOBAL_RPM,
+                 global_tpm: float = ADMISSION_GLOBAL_TPM,
+                 shared_counter: Optional[SharedWindowCounter] = None):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.max_queue_wait = max_queue_wait
+        self.min_service_time = min_service_time
+        self.user_rpm = user_rpm
+        self.user_burst = user_burst
+        self.user_tpm = user_tpm
+        self.global_requests = TokenBucket(global_rpm / 60, max(global_rpm / 6, 1))
+        self.global_tokens = TokenBucket(global_tpm / 60, global_tpm)
+        self.shared_counter = shared_counter
+        self.active = 0
+        self._users: "OrderedDict[str, Tuple[TokenBucket, TokenBucket]]" = OrderedDict()
+        self._waiters: list = []
+        self._sequence = itertools.count()
+
+    def _user_buckets(self, user_id: str) -> Tuple[TokenBucket, TokenBucket]:
+        buckets = self._users.get(user_id)
+        if buckets is None:
+            buckets = (TokenBucket(self.user_rpm / 60, self.user_burst),
+                       TokenBucket(self.user_tpm / 60, self.user_tpm))
+            self._users[user_id] = buckets
+            if len(self._users) > ADMISSION_MAX_TRACKED_USERS:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return buckets
+
+    def _reject(self, reason: str, retry_after: float) -> AdmissionRejected:
+        # Counted by acquire, which knows whether the caller will retry
+        return AdmissionRejected(reason, retry_after)
+
+    def _take_rate_limits(self, user_id: str, tokens: int) -> list:
+        """Consume from all buckets or from none of them"""
+        user_requests, user_tokens = self._user_buckets(user_id)
+        checks = [
+            ("user_requests", user_requests, 1),
+            ("user_tokens", user_tokens, tokens),
+            ("global_requests", self.global_requests, 1),
+            ("global_tokens", self.global_tokens, tokens),
+        ]
+        now = time.monotonic()
+        for reason, bucket, amount in checks:
+            wait = bucket.wait_time(amount, now)
+            if wait > 0:
+                raise self._reject(reason, wait)
+        for _, bucket, amount in checks:
+            bucket.consume(amount)
+        return checks
+
+    def try_take_global(self, tokens: int) -> bool:
+        """
+        Charge an extra upstream call, such as a hedge, to the global buckets.
+
+        Returns False without consuming anything if requests are queued or
+        either bucket lacks room, since extra calls are only worth it with spare capacity.
+        """
+        if self._waiters:
+            return False
+        now = time.monotonic()
+        if self.global_requests.wait_time(1, now) > 0 or self.global_tokens.wait_time(tokens, now) > 0:
+            return False
+        self.global_requests.consume(1)
+        self.global_tokens.consume(tokens)
+        return True
+
+    async def acquire(self, user_id: str, tokens: int, priority: int = PRIORITIES["normal"],
+                      deadline: Optional[float] = None, background: bool = False) -> None:
+        """
+        Admit a request or raise AdmissionRejected.
+
+        ``deadline`` is an absolute ``time.monotonic()`` timestamp. Rejections of
+        ``background`` callers, which wait and retry rather than fail, are
+        counted as deferrals instead of shed requests.
+        """
+        try:
+            await self._acquire(user_id, tokens, priority, deadline)
+        except AdmissionRejected as e:
+            (admission_deferrals_total if background else admission_rejections_total).inc(e.reason)
+            raise
+
+    async def _acquire(self, user_id: str, tokens: int, priority: int, deadline: Optional[float]) -> None:
+        now = time.monotonic()
+        if deadline is not None and deadline - now < self.min_service_time:
+            raise self._reject("deadline", self.min_service_time)
+
+        checks = self._take_rate_limits(user_id, tokens)
+        try:
+            if self.shared_counter is not None:
+                allowed, retry_after = await self.shared_counter.try_acquire()
+                if not allowed:
+                    raise self._reject("shared_requests", retry_after)
+            await self._acquire_slot(priority, deadline)
+        except BaseException:
+            # Also refund on errors and on cancellation, e.g. a queued client disconnecting
+            for _, bucket, amount in checks:
+                bucket.refund(amount)
+            raise
+
+    async def _acquire_slot(self, priority: int, deadline: Optional[float]) -> None:
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            admission_active.inc()
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise self._reject("queue_full", self.max_queue_wait)
+
+        timeout = self.max_queue_wait
+        if deadline is not None:
+            # Leave enough of the budget to actually serve the request once admitted
+            timeout = min(timeout, deadline - time.monotonic() - self.min_service_time)
+        future = asyncio.get_running_loop().create_future()
+        waiter = [priority, deadline if deadline is not None else math.inf, next(self._sequence), future]
+        heapq.heappush(self._waiters, waiter)
+        admission_queue_depth.inc()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            raise self._reject("queue_timeout", self.max_queue_wait)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: list) -> None:
+        future = waiter[-1]
+        if future.done() and not future.cancelled():
+            # Granted a slot at the same moment we gave up, hand it back
+            self.release()
+            return
+        future.cancel()
+        self._waiters.remove(waiter)
+        heapq.heapify(self._waiters)
+        admission_queue_depth.dec()
+
+    def release(self) -> None:
+        """Free a slot and hand it to the most urgent live waiter"""
+        self.active -= 1
+        admission_active.dec()
+        while self._waiters and self.active < self.max_concurrent:
+            _, _, _, future = heapq.heappop(self._waiters)
+            admission_queue_depth.dec()
+            if future.done():
+                continue
+            self.active += 1
+            admission_active.inc()
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def admit(self, user_id: str, tokens: int, priority: int = PRIORITIES["normal"],
+                    deadline: Optional[float] = None, background: bool = False):
+        await self.acquire(user_id, tokens, priority, deadline, background)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def request_deadline(request: Request) -> Optional[float]:
+    """Absolute monotonic deadline from the client's X-Deadline-Ms budget header, if any"""
+    budget_ms = request.headers.get("x-deadline-ms")
+    if not budget_ms:
+        return None
+    try:
+        return time.monotonic() + float(budget_ms) / 1000
+    except ValueError:
+        return None
+
+
+def is_trusted_caller(request: Request) -> bool:
+    """Whether the request carries the admin key or the internal service token"""
+    for header, secret in (("x-admin-key", ADMIN_API_KEY), ("x-internal-token", ADMISSION_INTERNAL_TOKEN)):
+        value = request.headers.get(header)
+        if secret and value and secrets.compare_digest(value, secret):
+            return True
+    return False
+
+
+def request_priority(request: Request) -> int:
+    """
+    Priority from the X-Priority header (high, normal or low).
+
+    Anyone may lower their priority, but only trusted callers may raise it;
+    otherwise any client could jump the queue.
+    """
+    priority = PRIORITIES.get(request.headers.get("x-priority", "normal").lower(), PRIORITIES["normal"])
+    if priority < PRIORITIES["normal"] and not is_trusted_caller(request):
+        return PRIORITIES["normal"]
+    return priority
+
+
+def caller_id(request: Request, user_id: Optional[str] = None) -> str:
+    """Identity used for per-user limits: the authenticated user, else the client address"""
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"ip:{request.client.host}" if request.client else "ip:unknown"
+
+
+gemini_admission = AdmissionController(
+    shared_counter=SharedWindowCounter("gemini", int(ADMISSION_GLOBAL_RPM)) if ADMISSION_SHARED_COUNTER else None,
+)
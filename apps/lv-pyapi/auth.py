@@ -0,0 +1,165 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import delete, select
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import HTTPConnection
+
+from database import SessionLocal
+from metrics import auth_cache_lookups_total
+from python_utils.hash_utils import hash_text
+from python_utils.sqlalchemy_models import Session as UserSession
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL_S = float(os.getenv("AUTH_CACHE_TTL_S", "60"))
+AUTH_NEGATIVE_CACHE_TTL_S = float(os.getenv("AUTH_NEGATIVE_CACHE_TTL_S", "10"))
+
+# NextAuth cookie names, most specific first
+SESSION_COOKIE_NAMES = (
+    "__Secure-next-auth.session-token",
+    "__Host-next-auth.session-token",
+    "next-auth.session-token",
+)
+
+
+def load_session(token: str) -> Tuple[Optional[str], float]:
+    """Look up a session token, returning the user id and seconds until the session expires"""
+    with SessionLocal() as db:
+        row = db.execute(
+            select(UserSession.userId, UserSession.expires).where(UserSession.sessionToken == token)
+        ).one_or_none()
+    if row is None:
+        return None, 0.0
+    # Prisma stores timestamps as naive UTC
+    expires_in = (row.expires - datetime.utcnow()).total_seconds()
+    if expires_in <= 0:
+        return None, 0.0
+    return str(row.userId), expires_in
+
+
+def delete_session(token: str) -> None:
+    """Delete a session on the primary, so no worker can load it again"""
+    with SessionLocal() as db:
+        db.execute(delete(UserSession).where(UserSession.sessionToken == token))
+        db.commit()
+
+
+class SessionTokenCache:
+    """
+    Bounded LRU cache of session token lookups.
+
+    Valid sessions are cached until the cache TTL or the session's own expiry,
+    whichever comes first; unknown or expired tokens are cached for a shorter
+    negative TTL. Concurrent lookups of the same uncached token share one
+    database query. Keys are token hashes, so raw tokens are never kept in memory.
+    """
+
+    def __init__(self, loader: Callable[[str], Tuple[Optional[str], float]] = load_session,
+                 max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL_S,
+                 negative_ttl: float = AUTH_NEGATIVE_CACHE_TTL_S):
+        self.loader = loader
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _store(self, key: str, user_id: Optional[str], expires_in: float) -> None:
+        ttl = min(self.ttl, expires_in) if user_id is not None else self.negative_ttl
+        self._entries[key] = (user_id, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def resolve(self, token: str) -> Optional[str]:
+        """User id for a session token, or None if the token is unknown or expired"""
+        key = hash_text(token)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                auth_cache_lookups_total.inc("hit")
+                return entry[0]
+            del self._entries[key]
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            auth_cache_lookups_total.inc("miss")
+            # The lookup runs as its own task so a cancelled caller doesn't fail the others
+            inflight = self._inflight[key] = asyncio.ensure_future(self._load(key, token))
+        else:
+            auth_cache_lookups_total.inc("coalesced")
+        return await asyncio.shield(inflight)
+
+    async def _load(self, key: str, token: str) -> Optional[str]:
+        task = asyncio.current_task()
+        try:
+            user_id, expires_in = await run_in_threadpool(self.loader, token)
+            # A lookup that raced an invalidation must not cache what it read
+            if self._inflight.get(key) is task:
+                self._store(key, user_id, expires_in)
+            return user_id
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    def invalidate(self, token: str) -> None:
+        """Drop a token from the cache, e.g. on logout"""
+        key = hash_text(token)
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+
+
+session_cache = SessionTokenCache()
+
+
+def session_token(request: HTTPConnection) -> Optional[str]:
+    """Session token from the Authorization header or the NextAuth session cookie"""
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip() or None
+    for name in SESSION_COOKIE_NAMES:
+        token = request.cookies.get(name)
+        if token:
+            return token
+    return None
+
+
+async def get_optional_user(request: Request) -> Optional[str]:
+    """Authenticated user id, or None for anonymous or invalid sessions"""
+    token = session_token(request)
+    if token is None:
+        return None
+    user_id = await session_cache.resolve(token)
+    return user_id
+
+
+async def get_current_user(user_id: Optional[str] = Depends(get_optional_user)) -> str:
+    """Authenticated user id, rejecting the request with 401 otherwise"""
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user_id
+
+
+router = APIRouter(prefix="/auth", tags=["auth"])
+
+
+@router.post("/logout")
+async def logout(request: Request):
+    """
+    Revoke the caller's session.
+
+    The session row is deleted and this worker's cache entry dropped at once;
+    other workers may accept the token from their caches for up to
+    AUTH_CACHE_TTL_S, since the cache is per process.
+    """
+    token = session_token(request)
+    if token is not None:
+        await run_in_threadpool(delete_session, token)
+        session_cache.invalidate(token)
+    return {"success": True}
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+from admission import PRIORITIES, AdmissionController, AdmissionRejected, estimate_tokens
+from gemini import GEMINI_DEFAULT_TIMEOUT_MS, DeadlineExceeded
+from metrics import admission_rejections_total
+
+BATCH_MAX_PROMPTS = int(os.getenv("BATCH_MAX_PROMPTS", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+# Overall budget for a batch without a tighter X-Deadline-Ms
+BATCH_MAX_DURATION_S = float(os.getenv("BATCH_MAX_DURATION_S", "120"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "10"))
+
+
+async def _run_item(index: int, prompt: str, generate: Callable[[str, Optional[float]], Awaitable[str]],
+                    admission: AdmissionController, user_id: str,
+                    semaphore: asyncio.Semaphore, deadline: float) -> dict:
+    """Run one prompt, waiting for admission capacity instead of failing fast"""
+    async with semaphore:
+        for attempt in range(BATCH_MAX_RETRIES + 1):
+            try:
+                # The batch deadline bounds the wait; each Gemini call keeps its usual timeout
+                item_deadline = min(deadline, time.monotonic() + GEMINI_DEFAULT_TIMEOUT_MS / 1000)
+                async with admission.admit(user_id, estimate_tokens(prompt), PRIORITIES["low"], item_deadline,
+                                           background=True):
+                    message = await generate(prompt, item_deadline)
+                    return {"index": index, "status": 200, "message": message}
+            except AdmissionRejected as e:
+                # Batch items are background work, so they back off rather than bounce,
+                # and only count as shed once they give up
+                if attempt == BATCH_MAX_RETRIES or time.monotonic() + e.retry_after >= deadline:
+                    admission_rejections_total.inc(e.reason)
+                    return {"index": index, "status": 429, "message": f"Too many requests ({e.reason})"}
+                await asyncio.sleep(e.retry_after)
+            except DeadlineExceeded as e:
+                return {"index": index, "status": 504, "message": str(e)}
+            except Exception as e:
+                return {"index": index, "status": 500, "message": str(e)}
+
+
+async def stream_batch(prompts: List[str], generate: Callable[[str, Optional[float]], Awaitable[str]],
+                       admission: AdmissionController, user_id: str,
+                       concurrency: int = BATCH_MAX_CONCURRENCY,
+                       deadline: Optional[float] = None) -> AsyncIterator[bytes]:
+    """
+    Run prompts concurrently and yield NDJSON lines in completion order.
+
+    Each line carries the prompt's ``index`` and its own ``status``, so one slow
+    or failing item never holds back or fails the rest of the batch. The batch
+    never runs past ``deadline`` or BATCH_MAX_DURATION_S, whichever is sooner.
+    """
+    max_deadline = time.monotonic() + BATCH_MAX_DURATION_S
+    deadline = max_deadline if deadline is None else min(deadline, max_deadline)
+    semaphore = asyncio.Semaphore(max(1, min(concurrency, BATCH_MAX_CONCURRENCY)))
+    tasks = [
+        asyncio.create_task(_run_item(index, prompt, generate, admission, user_id, semaphore, deadline))
+        for index, prompt in enumerate(prompts)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            yield (json.dumps(result) + "\n").encode()
+    finally:
+        # Stop outstanding work if the client disconnects mid-stream
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,88 @@
+"""
+Measure peak memory of a conversation export, streamed versus loaded in full.
+
+Seeds a throwaway user with MESSAGES rows in the database at DATABASE_URL,
+runs each export mode in a fresh subprocess so peak RSS is not shared, then
+removes the seeded rows.
+
+    PYTHONPATH=./packages/python-utils/src:./apps/lv-pyapi python apps/lv-pyapi/benchmarks/bench_export.py
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from sqlalchemy import select, text
+
+MESSAGES = int(os.getenv("BENCH_EXPORT_MESSAGES", "1000000"))
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_export(mode: str, user_id: str) -> None:
+    from conversations import encode_export, gzip_stream, message_batches
+    from database import SessionLocal
+    from python_utils.sqlalchemy_models import ConversationMessage
+
+    start = time.perf_counter()
+    first_byte = None
+    total = 0
+    if mode == "list":
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(ConversationMessage.messageId, ConversationMessage.sender,
+                       ConversationMessage.createdAt, ConversationMessage.content)
+                .where(ConversationMessage.userId == user_id)
+                .order_by(ConversationMessage.createdAt, ConversationMessage.messageId)
+            ).all()
+        chunks = encode_export([rows], "ndjson")
+    else:
+        chunks = encode_export(message_batches(user_id), "ndjson")
+        if mode == "stream-gzip":
+            chunks = gzip_stream(chunks)
+    for chunk in chunks:
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        total += len(chunk)
+    elapsed = time.perf_counter() - start
+    print(f"{mode:12s} peak RSS {peak_rss_mb():8.1f} MB   first byte {first_byte * 1000:8.1f} ms   "
+          f"total {elapsed:6.2f} s   {total / 1e6:8.1f} MB out")
+
+
+def main():
+    from database import engine
+
+    with engine.begin() as conn:
+        user_id = conn.execute(text(
+            """INSERT INTO "public"."User" ("email", "updatedAt") VALUES ('bench-export@example.com', now()) RETURNING "id" """
+        )).scalar_one()
+        conn.execute(text(
+            """
+            INSERT INTO "public"."ConversationMessage" ("userId", "sender", "content", "createdAt")
+            SELECT :user_id,
+                   CASE WHEN i % 2 = 0 THEN 'USER'::"MessageSender" ELSE 'AI'::"MessageSender" END,
+                   repeat('Tell me more about vector databases. ', 8) || i,
+                   now() - make_interval(secs => i)
+            FROM generate_series(1, :messages) AS i
+            """
+        ), {"user_id": user_id, "messages": MESSAGES})
+    print(f"Seeded {MESSAGES} messages")
+
+    try:
+        for mode in ("stream", "stream-gzip", "list"):
+            subprocess.run([sys.executable, __file__, mode, str(user_id)], check=True)
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text('DELETE FROM "public"."ConversationMessage" WHERE "userId" = :user_id'), {"user_id": user_id})
+            conn.execute(text('DELETE FROM "public"."User" WHERE "id" = :user_id'), {"user_id": user_id})
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        run_export(sys.argv[1], sys.argv[2])
+    else:
+        main()
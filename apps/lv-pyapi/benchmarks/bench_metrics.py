@@ -0,0 +1,75 @@
+"""
+Measure the per-request overhead of the metrics middleware.
+
+Drives a bare and an instrumented FastAPI app directly through ASGI, so the
+numbers exclude network and test client costs.
+
+    PYTHONPATH=./packages/python-utils/src:./apps/lv-pyapi python apps/lv-pyapi/benchmarks/bench_metrics.py
+"""
+import asyncio
+import time
+import timeit
+
+from fastapi import FastAPI
+
+from metrics import Counter, Histogram, MetricsMiddleware
+
+REQUESTS = 20000
+
+
+def build_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/users/{user_id}")
+    async def get_user(user_id: str):
+        return {"id": user_id}
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def drive(app: FastAPI, requests: int) -> float:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/users/42", "raw_path": b"/users/42", "root_path": "",
+        "query_string": b"", "headers": [], "client": ("127.0.0.1", 1234), "server": ("test", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return time.perf_counter() - start
+
+
+def main():
+    bare = build_app(instrumented=False)
+    instrumented = build_app(instrumented=True)
+    # Warm up both apps so middleware stacks are built before timing
+    asyncio.run(drive(bare, 100))
+    asyncio.run(drive(instrumented, 100))
+
+    bare_time = asyncio.run(drive(bare, REQUESTS))
+    instrumented_time = asyncio.run(drive(instrumented, REQUESTS))
+    overhead_us = (instrumented_time - bare_time) / REQUESTS * 1e6
+    print(f"bare:          {bare_time / REQUESTS * 1e6:8.2f} us/request")
+    print(f"instrumented:  {instrumented_time / REQUESTS * 1e6:8.2f} us/request")
+    print(f"overhead:      {overhead_us:8.2f} us/request")
+
+    counter = Counter("bench_total", "Benchmark counter", ("route",))
+    histogram = Histogram("bench_seconds", "Benchmark histogram", ("route",))
+    loops = 1_000_000
+    inc_ns = timeit.timeit(lambda: counter.inc("/users/{user_id}"), number=loops) / loops * 1e9
+    observe_ns = timeit.timeit(lambda: histogram.observe(0.012, "/users/{user_id}"), number=loops) / loops * 1e9
+    print(f"Counter.inc:       {inc_ns:6.0f} ns")
+    print(f"Histogram.observe: {observe_ns:6.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, NamedTuple, Optional
+
+from fastapi import Request, Response
+
+HTTP_CACHE_CONTROL = os.getenv("HTTP_CACHE_CONTROL", "private, no-cache")
+
+
+class Validators(NamedTuple):
+    """ETag and Last-Modified for one representation of a resource"""
+    etag: str
+    last_modified: Optional[datetime]
+
+
+def validators_for(*parts, last_modified: Optional[datetime] = None) -> Validators:
+    """
+    Validators from the values a representation is derived from.
+
+    ``parts`` should identify the resource and its version (e.g. id and
+    updatedAt) plus anything else that changes the body, such as query
+    parameters or content encoding.
+    """
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:20]
+    if last_modified is not None and last_modified.tzinfo is None:
+        # Prisma stores timestamps as naive UTC
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # Weak, since equivalent bodies may not be byte-identical across versions of the API
+    return Validators(f'W/"{digest}"', last_modified)
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def not_modified(request: Request, validators: Validators) -> bool:
+    """Whether the client's cached copy is current; If-None-Match wins over If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or validators.etag.removeprefix("W/") in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or validators.last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have one-second resolution
+    return validators.last_modified.replace(microsecond=0) <= since
+
+
+def cache_headers(validators: Validators, cache_control: str = HTTP_CACHE_CONTROL) -> Dict[str, str]:
+    headers = {"ETag": validators.etag, "Cache-Control": cache_control}
+    if validators.last_modified is not None:
+        headers["Last-Modified"] = format_datetime(validators.last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def not_modified_response(validators: Validators, cache_control: str = HTTP_CACHE_CONTROL) -> Response:
+    return Response(status_code=304, headers=cache_headers(validators, cache_control))
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, List, Optional, Set, Tuple
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from google.genai import types
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+import gemini
+from admission import PRIORITIES, AdmissionRejected, caller_id, estimate_tokens, gemini_admission
+from auth import session_cache, session_token
+from database import ReadSessionLocal
+from metrics import chat_connections_active, chat_connections_rejected_total, chat_evictions_total, chat_turns_total
+from python_utils.sqlalchemy_models import ConversationMessage, MessageSender
+from write_behind import conversation_writer
+
+CHAT_MAX_CONNECTIONS = int(os.getenv("CHAT_MAX_CONNECTIONS", "500"))
+CHAT_HEARTBEAT_INTERVAL_S = float(os.getenv("CHAT_HEARTBEAT_INTERVAL_S", "20"))
+CHAT_IDLE_TIMEOUT_S = float(os.getenv("CHAT_IDLE_TIMEOUT_S", "600"))
+CHAT_CONTEXT_MESSAGES = int(os.getenv("CHAT_CONTEXT_MESSAGES", "20"))
+CHAT_MAX_MESSAGE_CHARS = int(os.getenv("CHAT_MAX_MESSAGE_CHARS", "8000"))
+
+# Browsers send cookies on cross-site WebSocket handshakes, so the Origin is checked like CORS would
+CHAT_ALLOWED_ORIGINS = {
+    origin.strip() for origin in os.getenv("FRONTEND_ORIGINS", "http://localhost:3045").split(",") if origin.strip()
+}
+
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class ChatConnection:
+    """Per-connection state: the user, recent conversation context and liveness"""
+
+    def __init__(self, websocket: WebSocket, user_id: str):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.history: Deque[Tuple[MessageSender, str]] = deque(maxlen=CHAT_CONTEXT_MESSAGES)
+        now = time.monotonic()
+        # Any frame from the client, pongs included, proves it is still there
+        self.last_seen = now
+        self.last_turn = now
+        self.busy = False
+
+    def contents(self, message: str) -> List[types.Content]:
+        """The conversation so far plus the new message, as Gemini contents"""
+        turns = [*self.history, (MessageSender.USER, message)]
+        return [
+            types.Content(role="user" if sender is MessageSender.USER else "model", parts=[types.Part(text=text)])
+            for sender, text in turns
+        ]
+
+    def eviction_reason(self, now: float) -> Optional[str]:
+        """Why the connection should be closed, or None to keep it"""
+        if self.busy:
+            return None
+        if now - self.last_seen > 2 * CHAT_HEARTBEAT_INTERVAL_S:
+            return "heartbeat"
+        if now - self.last_turn > CHAT_IDLE_TIMEOUT_S:
+            return "idle"
+        return None
+
+
+connections: Set[ChatConnection] = set()
+chat_connections_active.set_function(lambda: len(connections))
+
+
+def load_history(user_id: str) -> List[Tuple[MessageSender, str]]:
+    """The user's most recent messages, oldest first, loaded once per connection"""
+    with ReadSessionLocal() as db:
+        rows = db.execute(
+            select(ConversationMessage.sender, ConversationMessage.content)
+            .where(ConversationMessage.userId == user_id)
+            .order_by(ConversationMessage.createdAt.desc())
+            .limit(CHAT_CONTEXT_MESSAGES)
+        ).all()
+    return [(row.sender, row.content) for row in reversed(rows)]
+
+
+async def _send_error(websocket: WebSocket, status: int, message: str, **extra) -> None:
+    await websocket.send_json({"type": "error", "status": status, "message": message, **extra})
+
+
+async def run_turn(connection: ChatConnection, message: str) -> None:
+    """Stream Gemini's reply to one message as token frames, then record the turn"""
+    websocket = connection.websocket
+    prompt_at = datetime.utcnow()
+    deadline = time.monotonic() + gemini.GEMINI_DEFAULT_TIMEOUT_MS / 1000
+    contents = connection.contents(message)
+    chunks = []
+    connection.busy = True
+    try:
+        tokens = sum(estimate_tokens(part.text) for content in contents for part in content.parts)
+        async with gemini_admission.admit(
+            caller_id(websocket, connection.user_id), tokens, PRIORITIES["normal"], deadline
+        ):
+            async with asyncio.timeout(deadline - time.monotonic()):
+                async for text in gemini.stream_content(contents, timeout=deadline - time.monotonic()):
+                    chunks.append(text)
+                    await websocket.send_json({"type": "token", "content": text})
+    except AdmissionRejected as e:
+        chat_turns_total.inc("rejected")
+        await _send_error(websocket, 429, f"Too many requests ({e.reason})", retryAfter=e.retry_after)
+        return
+    except TimeoutError:
+        chat_turns_total.inc("timeout")
+        await _send_error(websocket, 504, "Deadline exceeded before Gemini responded")
+        return
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        chat_turns_total.inc("error")
+        await _send_error(websocket, 500, str(e))
+        return
+    finally:
+        connection.busy = False
+
+    reply = "".join(chunks)
+    reply_at = datetime.utcnow()
+    connection.history.append((MessageSender.USER, message))
+    connection.history.append((MessageSender.AI, reply))
+    conversation_writer.record_exchange(connection.user_id, message, prompt_at, reply, reply_at)
+    chat_turns_total.inc("success")
+    await websocket.send_json({"type": "done"})
+
+
+async def heartbeat(connection: ChatConnection) -> None:
+    """Ping the client periodically and close connections that went quiet"""
+    while True:
+        await asyncio.sleep(CHAT_HEARTBEAT_INTERVAL_S)
+        reason = connection.eviction_reason(time.monotonic())
+        if reason is not None:
+            chat_evictions_total.inc(reason)
+            await connection.websocket.close(code=CLOSE_GOING_AWAY, reason=reason)
+            return
+        await connection.websocket.send_json({"type": "ping"})
+
+
+def _parse_frame(raw: str) -> Optional[dict]:
+    try:
+        frame = json.loads(raw)
+    except ValueError:
+        return None
+    return frame if isinstance(frame, dict) else None
+
+
+router = APIRouter()
+
+
+@router.websocket("/ws/chat")
+async def chat(websocket: WebSocket):
+    """
+    Interview chat over one WebSocket.
+
+    The session is authenticated once at the handshake. Client frames are
+    ``{"type": "message", "content": ...}`` and ``{"type": "pong"}``; the server
+    replies with ``token`` frames followed by ``done``, or an ``error`` frame,
+    and sends ``ping`` frames as a heartbeat.
+    """
+    origin = websocket.headers.get("origin")
+    token = session_token(websocket)
+    user_id = await session_cache.resolve(token) if token else None
+    await websocket.accept()
+
+    if origin is not None and origin not in CHAT_ALLOWED_ORIGINS:
+        chat_connections_rejected_total.inc("origin")
+        await websocket.close(code=CLOSE_POLICY_VIOLATION, reason="Origin not allowed")
+        return
+    if user_id is None:
+        chat_connections_rejected_total.inc("unauthenticated")
+        await websocket.close(code=CLOSE_POLICY_VIOLATION, reason="Not authenticated")
+        return
+    if len(connections) >= CHAT_MAX_CONNECTIONS:
+        chat_connections_rejected_total.inc("capacity")
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason="Too many connections")
+        return
+
+    connection = ChatConnection(websocket, user_id)
+    connections.add(connection)
+    heartbeat_task = None
+    try:
+        connection.history.extend(await run_in_threadpool(load_history, user_id))
+        heartbeat_task = asyncio.create_task(heartbeat(connection))
+        while True:
+            frame = _parse_frame(await websocket.receive_text())
+            connection.last_seen = time.monotonic()
+            if frame is None:
+                await _send_error(websocket, 400, "Frames must be JSON objects")
+                continue
+            kind = frame.get("type")
+            if kind == "pong":
+                continue
+            if kind == "ping":
+                await websocket.send_json({"type": "pong"})
+                continue
+            content = frame.get("content")
+            if kind != "message" or not isinstance(content, str) or not content.strip():
+                await _send_error(websocket, 400, "Expected a message with non-empty content")
+                continue
+            if len(content) > CHAT_MAX_MESSAGE_CHARS:
+                await _send_error(websocket, 413, f"Messages are limited to {CHAT_MAX_MESSAGE_CHARS} characters")
+                continue
+            connection.last_turn = connection.last_seen
+            await run_turn(connection, content.strip())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
+        connections.discard(connection)
@@ -0,0 +1,345 @@
+import base64
+import binascii
+import csv
+import html
+import io
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, Literal, Optional, Sequence, Tuple
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import REAL, cast, func, select, tuple_
+from sqlalchemy.dialects.postgresql import UUID as PostgresUUID
+from sqlalchemy.orm import Session
+
+from auth import get_current_user
+from caching import Validators, cache_headers, not_modified, not_modified_response, validators_for
+from database import ReadSessionLocal, get_read_db
+from python_utils.sqlalchemy_models import ConversationMessage, ConversationStats
+
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "50"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_COLUMNS = ("messageId", "sender", "createdAt", "content")
+
+# Must match the configuration of the generated searchVector column
+SEARCH_CONFIG = "english"
+
+# Private-use characters mark highlights so snippets can be HTML-escaped safely
+_HIGHLIGHT_START = "\ue000"
+_HIGHLIGHT_STOP = "\ue001"
+HEADLINE_OPTIONS = f"StartSel={_HIGHLIGHT_START}, StopSel={_HIGHLIGHT_STOP}, MaxWords=30, MinWords=10, MaxFragments=2"
+
+
+def stats_response(user_id: str, stats: Optional[ConversationStats]) -> dict:
+    """Serialise a user's conversation stats, all zero if they have no messages yet"""
+    if stats is None:
+        return {
+            "userId": user_id,
+            "messageCount": 0,
+            "userMessageCount": 0,
+            "aiMessageCount": 0,
+            "totalCharacters": 0,
+            "lastMessageAt": None,
+        }
+    return {
+        "userId": user_id,
+        "messageCount": stats.userMessageCount + stats.aiMessageCount,
+        "userMessageCount": stats.userMessageCount,
+        "aiMessageCount": stats.aiMessageCount,
+        "totalCharacters": stats.totalCharacters,
+        "lastMessageAt": stats.lastMessageAt.isoformat() if stats.lastMessageAt else None,
+    }
+
+
+def load_stats(db: Session, user_ids: Iterable[str]) -> List[dict]:
+    """Conversation stats for each user id, in the order given"""
+    user_ids = list(user_ids)
+    rows = db.execute(select(ConversationStats).where(ConversationStats.userId.in_(user_ids))).scalars()
+    by_user = {str(stats.userId): stats for stats in rows}
+    return [stats_response(user_id, by_user.get(user_id)) for user_id in user_ids]
+
+
+def require_owner(user_id: str, current_user: str = Depends(get_current_user)) -> str:
+    """Only let users read their own conversation data"""
+    if user_id != current_user:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return user_id
+
+
+def stats_validators(user_id: str, updated_at: Optional[datetime], last_message_at: Optional[datetime],
+                     *variant) -> Validators:
+    """Validators for anything derived from a user's messages"""
+    version = updated_at.isoformat() if updated_at is not None else "empty"
+    return validators_for("messages", user_id, version, *variant, last_modified=last_message_at)
+
+
+def message_validators(db: Session, user_id: str, *variant) -> Validators:
+    """
+    Validators for a user's message lists, from the ConversationStats row alone.
+
+    Last-Modified is the newest message's createdAt; the ETag also covers the
+    row's updatedAt, which the triggers bump on edits and deletes too.
+    """
+    row = db.execute(
+        select(ConversationStats.updatedAt, ConversationStats.lastMessageAt)
+        .where(ConversationStats.userId == user_id)
+    ).one_or_none()
+    if row is None:
+        return stats_validators(user_id, None, None, *variant)
+    return stats_validators(user_id, row.updatedAt, row.lastMessageAt, *variant)
+
+
+# Handlers are plain functions so FastAPI runs their synchronous queries in the
+# thread pool instead of on the event loop
+router = APIRouter(tags=["conversations"])
+
+
+@router.get("/users/{user_id}/stats")
+def get_user_stats(request: Request, user_id: str = Depends(require_owner), db: Session = Depends(get_read_db)):
+    """Message counts for a user, read from the trigger-maintained ConversationStats row"""
+    try:
+        stats = db.execute(select(ConversationStats).where(ConversationStats.userId == user_id)).scalar_one_or_none()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    validators = stats_validators(
+        user_id,
+        stats.updatedAt if stats is not None else None,
+        stats.lastMessageAt if stats is not None else None,
+        "stats",
+    )
+    if not_modified(request, validators):
+        return not_modified_response(validators)
+    return JSONResponse(content=stats_response(user_id, stats), headers=cache_headers(validators))
+
+
+def encode_cursor(rank: float, message_id: str) -> str:
+    """Opaque keyset cursor for the position after a search result"""
+    raw = json.dumps({"rank": rank, "id": message_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Inverse of encode_cursor, rejecting anything malformed with 400"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(data["rank"]), str(UUID(data["id"]))
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def render_snippet(headline: str) -> str:
+    """HTML-escape a ts_headline fragment, then turn its highlight markers into <mark> tags"""
+    return html.escape(headline).replace(_HIGHLIGHT_START, "<mark>").replace(_HIGHLIGHT_STOP, "</mark>")
+
+
+def search_statement(user_id: str, q: str, limit: int, after: Optional[Tuple[float, str]] = None):
+    """
+    Ranked full-text search over one user's messages.
+
+    Matches come from the GIN index on searchVector; ts_headline is costly, so
+    snippets are only built for the rows of the requested page.
+    """
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    rank = func.ts_rank(ConversationMessage.searchVector, query)
+    page = (
+        select(
+            ConversationMessage.messageId,
+            ConversationMessage.sender,
+            ConversationMessage.content,
+            ConversationMessage.createdAt,
+            rank.label("rank"),
+        )
+        .where(ConversationMessage.userId == user_id, ConversationMessage.searchVector.op("@@")(query))
+        .order_by(rank.desc(), ConversationMessage.messageId.desc())
+        .limit(limit)
+    )
+    if after is not None:
+        # ts_rank returns real, so compare as real to resume exactly after the cursor row
+        after_rank, after_id = after
+        page = page.where(
+            tuple_(rank, ConversationMessage.messageId)
+            < tuple_(cast(after_rank, REAL), cast(after_id, PostgresUUID(as_uuid=True)))
+        )
+    page = page.subquery()
+    return (
+        select(
+            page.c.messageId,
+            page.c.sender,
+            page.c.createdAt,
+            page.c.rank,
+            func.ts_headline(SEARCH_CONFIG, page.c.content, query, HEADLINE_OPTIONS).label("headline"),
+        )
+        .order_by(page.c.rank.desc(), page.c.messageId.desc())
+    )
+
+
+@router.get("/users/{user_id}/messages/search")
+def search_user_messages(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(require_owner),
+    db: Session = Depends(get_read_db),
+):
+    """Search a user's messages, best matches first, with highlighted snippets"""
+    after = decode_cursor(cursor) if cursor else None
+    try:
+        validators = message_validators(db, user_id, "search", q, limit, cursor)
+        if not_modified(request, validators):
+            return not_modified_response(validators)
+        # Fetch one extra row to know whether another page follows
+        rows = db.execute(search_statement(user_id, q, limit + 1, after)).all()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    body = {
+        "results": [
+            {
+                "messageId": str(row.messageId),
+                "sender": row.sender.value,
+                "createdAt": row.createdAt.isoformat(),
+                "rank": row.rank,
+                "snippet": render_snippet(row.headline),
+            }
+            for row in rows
+        ],
+        "nextCursor": encode_cursor(rows[-1].rank, str(rows[-1].messageId)) if has_more else None,
+    }
+    return JSONResponse(content=body, headers=cache_headers(validators))
+
+
+def naive_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    """Prisma stores naive UTC; comparing like with like lets the planner prune partitions"""
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def message_batches(user_id: str, batch_size: int = EXPORT_BATCH_SIZE, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None) -> Iterator[Sequence]:
+    """
+    A user's messages in chronological batches, read through a server-side cursor.
+
+    Only one batch is held in memory at a time. The generator owns its session
+    because request-scoped sessions are closed before a streaming body is sent.
+    ``since`` and ``until`` bound createdAt, so only the monthly partitions in
+    range are scanned.
+    """
+    stmt = (
+        select(
+            ConversationMessage.messageId,
+            ConversationMessage.sender,
+            ConversationMessage.createdAt,
+            ConversationMessage.content,
+        )
+        .where(ConversationMessage.userId == user_id)
+        .order_by(ConversationMessage.createdAt, ConversationMessage.messageId)
+        .execution_options(yield_per=batch_size)
+    )
+    if since is not None:
+        stmt = stmt.where(ConversationMessage.createdAt >= since)
+    if until is not None:
+        stmt = stmt.where(ConversationMessage.createdAt < until)
+    with ReadSessionLocal() as db:
+        yield from db.execute(stmt).partitions()
+
+
+def _export_record(row) -> tuple:
+    return str(row.messageId), row.sender.value, row.createdAt.isoformat(), row.content
+
+
+def encode_export(batches: Iterable[Sequence], export_format: str) -> Iterator[bytes]:
+    """Encode batches of message rows as NDJSON or CSV, one chunk per batch"""
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        # The header goes out before the query runs, so the first byte is immediate
+        yield buffer.getvalue().encode()
+        for batch in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(_export_record(row) for row in batch)
+            yield buffer.getvalue().encode()
+        return
+
+    for batch in batches:
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, _export_record(row)))) + "\n" for row in batch).encode()
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honouring q-values and ``*``"""
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def gzip_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Gzip a byte stream incrementally, flushing after every chunk so nothing is held back"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@router.get("/users/{user_id}/messages/export")
+def export_user_messages(
+    request: Request,
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    since: Optional[datetime] = Query(None, description="Only messages created at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only messages created before this time"),
+    user_id: str = Depends(require_owner),
+    db: Session = Depends(get_read_db),
+):
+    """Stream a user's conversation history, gzipped when the client accepts it"""
+    gzipped = accepts_gzip(request.headers.get("accept-encoding"))
+    since, until = naive_utc(since), naive_utc(until)
+    try:
+        validators = message_validators(
+            db, user_id, "export", export_format, since, until, "gzip" if gzipped else "identity")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if not_modified(request, validators):
+        # The ETag depends on the encoding, so caches must key the 304 on it too
+        response = not_modified_response(validators)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    chunks = encode_export(message_batches(user_id, since=since, until=until), export_format)
+    headers = {
+        "Content-Disposition": f'attachment; filename="messages-{user_id}.{export_format}"',
+        "Vary": "Accept-Encoding",
+        **cache_headers(validators),
+    }
+    if gzipped:
+        chunks = gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+    # Sync iterators run in the thread pool, so database reads never block the event loop
+    return StreamingResponse(chunks, media_type=EXPORT_MEDIA_TYPES[export_format], headers=headers)
@@ -1,21 +1,222 @@
+import itertools
+import logging
 import os
+import threading
+import time
+from typing import List, Optional
+
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from fastapi import Request
+from starlette.datastructures import MutableHeaders
+from sqlalchemy import Delete, Insert, Update, create_engine, event, text
+from sqlalchemy.orm import Session, sessionmaker
+
+from metrics import db_reads_routed_total, db_replicas_healthy, instrument_engine
+from slow_query import SlowQueryLog
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is required")
 
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DATABASE_REPLICA_STRATEGY = os.getenv("DATABASE_REPLICA_STRATEGY", "round_robin")
+DATABASE_REPLICA_MAX_LAG_S = float(os.getenv("DATABASE_REPLICA_MAX_LAG_S", "10"))
+DATABASE_REPLICA_HEALTH_INTERVAL_S = float(os.getenv("DATABASE_REPLICA_HEALTH_INTERVAL_S", "5"))
+# How long a client's reads stay on the primary after it writes; covers the tolerated replica lag
+DATABASE_READ_YOUR_WRITES_S = int(os.getenv("DATABASE_READ_YOUR_WRITES_S", str(int(DATABASE_REPLICA_MAX_LAG_S))))
+READ_PRIMARY_COOKIE = "lv-read-primary"
+
 engine = create_engine(DATABASE_URL)
+instrument_engine(engine)
+slow_query_log = SlowQueryLog(DATABASE_URL)
+slow_query_log.install(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
+
+class Replica:
+    """A read replica engine and its last known health"""
+
+    def __init__(self, url: str):
+        self.engine = create_engine(url, pool_pre_ping=True)
+        self.healthy = True
+        instrument_engine(self.engine)
+        slow_query_log.install(self.engine)
+        event.listen(self.engine, "handle_error", self._handle_error)
+
+    def _handle_error(self, context) -> None:
+        # A dropped connection takes the replica out of rotation until the next health check
+        if context.is_disconnect:
+            self.healthy = False
+
+    def check(self) -> None:
+        try:
+            with self.engine.connect() as conn:
+                # The last replayed commit ages while the primary is idle, so a
+                # replica that has replayed everything it received counts as current
+                lag = conn.execute(text(
+                    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                )).scalar_one()
+            self.healthy = float(lag) <= DATABASE_REPLICA_MAX_LAG_S
+        except Exception as e:
+            if self.healthy:
+                logger.warning(f"Replica {self.engine.url.host} marked unhealthy: {e}")
+            self.healthy = False
+
+    def in_use(self) -> int:
+        return self.engine.pool.checkedout()
+
+
+class ReplicaPool:
+    """
+    Chooses a healthy replica for reads, round-robin or least-connections.
+
+    Health is refreshed by a background thread; with no healthy replica left,
+    reads fail over to the primary.
+    """
+
+    def __init__(self, urls: List[str], strategy: str = DATABASE_REPLICA_STRATEGY):
+        self.replicas = [Replica(url) for url in urls]
+        self.strategy = strategy
+        self._counter = itertools.count()
+        self._health_thread: Optional[threading.Thread] = None
+
+    def healthy(self) -> List[Replica]:
+        return [replica for replica in self.replicas if replica.healthy]
+
+    def choose(self):
+        """Engine to read from, falling back to the primary"""
+        healthy = self.healthy()
+        if not healthy:
+            return engine
+        if self.strategy == "least_connections":
+            return min(healthy, key=Replica.in_use).engine
+        return healthy[next(self._counter) % len(healthy)].engine
+
+    def start_health_checks(self) -> None:
+        if not self.replicas or self._health_thread is not None:
+            return
+        self._health_thread = threading.Thread(target=self._run_health_checks, name="replica-health", daemon=True)
+        self._health_thread.start()
+
+    def _run_health_checks(self) -> None:
+        while True:
+            for replica in self.replicas:
+                replica.check()
+            time.sleep(DATABASE_REPLICA_HEALTH_INTERVAL_S)
+
+
+replica_pool = ReplicaPool(DATABASE_REPLICA_URLS)
+replica_pool.start_health_checks()
+db_replicas_healthy.set_function(lambda: len(replica_pool.healthy()))
+
+
+class RoutingSession(Session):
+    """
+    Session sending reads to a replica and writes to the primary.
+
+    The replica is chosen once per session so reads within a request see one
+    consistent snapshot. Every statement goes to the primary after the
+    session's first write, once the request has written elsewhere (a
+    ``get_db`` session or a ``mark_write`` call), or while the client still
+    holds the cookie set by ReadYourWritesMiddleware after a recent write, so
+    clients read their own writes across requests too.
+    """
+
+    def _pinned(self) -> bool:
+        if self.info.get("pinned"):
+            return True
+        state = self.info.get("request_state")
+        return state is not None and getattr(state, "db_pinned", False)
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            self.info["pinned"] = True
+        if self._pinned():
+            db_reads_routed_total.inc("primary")
+            return engine
+        bind = self.info.get("replica")
+        if bind is None:
+            bind = self.info["replica"] = replica_pool.choose()
+        db_reads_routed_total.inc("replica" if bind is not engine else "primary")
+        return bind
+
+
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
+
+
+def mark_write(request: Request) -> None:
+    """Pin this request's reads, and the client's for DATABASE_READ_YOUR_WRITES_S, to the primary"""
+    request.state.db_pinned = True
+    request.state.db_wrote = True
+
+
+def _pin_request_on_write(db: Session, request: Request) -> None:
+    """Pin the rest of the request's reads to the primary once this session writes"""
+    def after_flush(session, flush_context):
+        mark_write(request)
+
+    def do_orm_execute(orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            mark_write(request)
+
+    event.listen(db, "after_flush", after_flush)
+    event.listen(db, "do_orm_execute", do_orm_execute)
+
+
+def get_db(request: Request):
     """Database dependency for FastAPI"""
     db = SessionLocal()
+    _pin_request_on_write(db, request)
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def get_read_db(request: Request):
+    """Database dependency for read-mostly endpoints, routed to read replicas"""
+    if request.cookies.get(READ_PRIMARY_COOKIE):
+        request.state.db_pinned = True
+    db = ReadSessionLocal(info={"request_state": request.state})
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware keeping a client's reads on the primary right after it writes.
+
+    Responses to requests that wrote set a short-lived cookie; while the
+    client sends it back, get_read_db sends its reads to the primary, so a
+    lagging replica can't hide what the client just wrote.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Shared with request.state in the endpoint
+        state = scope.setdefault("state", {})
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and state.get("db_wrote"):
+                secure = "; Secure" if scope.get("scheme") == "https" else ""
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{READ_PRIMARY_COOKIE}=1; Max-Age={DATABASE_READ_YOUR_WRITES_S}; Path=/; HttpOnly; "
+                    f"SameSite=Lax{secure}",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,237 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, List, Optional, Union
+
+import httpx
+from dotenv import load_dotenv
+from google import genai
+from google.genai import errors, types
+
+from admission import estimate_tokens, gemini_admission
+from metrics import (gemini_hedge_wins_total, gemini_hedges_skipped_total, gemini_hedges_total,
+                     gemini_request_duration, gemini_retries_total, gemini_time_to_first_token, gemini_tokens_total)
+
+load_dotenv()
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_DEFAULT_TIMEOUT_MS = int(os.getenv("GEMINI_DEFAULT_TIMEOUT_MS", "30000"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_RETRY_BASE_MS = int(os.getenv("GEMINI_RETRY_BASE_MS", "200"))
+GEMINI_RETRY_MAX_MS = int(os.getenv("GEMINI_RETRY_MAX_MS", "5000"))
+GEMINI_MIN_ATTEMPT_MS = int(os.getenv("GEMINI_MIN_ATTEMPT_MS", "500"))
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "false").lower() == "true"
+GEMINI_HEDGE_MIN_DELAY_MS = int(os.getenv("GEMINI_HEDGE_MIN_DELAY_MS", "1000"))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "50"))
+# Share of requests that may be hedged, so a general slowdown can't double upstream traffic
+GEMINI_HEDGE_BUDGET_RATIO = float(os.getenv("GEMINI_HEDGE_BUDGET_RATIO", "0.05"))
+GEMINI_HEDGE_BUDGET_BURST = float(os.getenv("GEMINI_HEDGE_BUDGET_BURST", "5"))
+
+# Status codes worth retrying: timeouts, rate limits and transient server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request's deadline runs out before Gemini answers"""
+
+
+class LatencyTracker:
+    """Rolling window of recent successful call latencies"""
+
+    def __init__(self, size: int = 500):
+        self.samples: deque = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.samples) < GEMINI_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+latency_tracker = LatencyTracker()
+
+
+class HedgeBudget:
+    """Every request earns ``ratio`` of a hedge, up to ``burst`` saved hedges"""
+
+    def __init__(self, ratio: float = GEMINI_HEDGE_BUDGET_RATIO, burst: float = GEMINI_HEDGE_BUDGET_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def refund(self) -> None:
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+hedge_budget = HedgeBudget()
+
+
+def _record_usage(model: str, usage) -> None:
+    """Record token usage reported by Gemini"""
+    if usage is None:
+        return
+    for kind, value in (
+        ("prompt", usage.prompt_token_count),
+        ("completion", usage.candidates_token_count),
+        ("thoughts", usage.thoughts_token_count),
+    ):
+        if value:
+            gemini_tokens_total.inc(model, kind, amount=value)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed call is worth retrying"""
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError))
+
+
+def _retry_reason(error: BaseException) -> str:
+    if isinstance(error, errors.APIError):
+        return str(error.code)
+    if isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return "timeout"
+    return "transport"
+
+
+async def stream_content(prompt: Union[str, List[types.Content]], model: str = GEMINI_MODEL,
+                         timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """
+    Stream text chunks from Gemini, recording latency, time to first token and token usage.
+
+    ``prompt`` is a single prompt or a multi-turn conversation.
+    """
+    config = None
+    if timeout is not None:
+        config = types.GenerateContentConfig(http_options=types.HttpOptions(timeout=int(timeout * 1000)))
+    start = time.perf_counter()
+    outcome = "error"
+    usage = None
+    first_chunk = True
+    try:
+        async for chunk in await client.aio.models.generate_content_stream(
+            model=model, contents=prompt, config=config
+        ):
+            if first_chunk:
+                gemini_time_to_first_token.observe(time.perf_counter() - start, model)
+                first_chunk = False
+            # The final chunk carries the cumulative usage for the whole response
+            if chunk.usage_metadata is not None:
+                usage = chunk.usage_metadata
+            if chunk.text:
+                yield chunk.text
+        outcome = "success"
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        gemini_request_duration.observe(elapsed, model, outcome)
+        if outcome == "success":
+            latency_tracker.observe(elapsed)
+        _record_usage(model, usage)
+
+
+async def _attempt(prompt: str, model: str, timeout: float) -> str:
+    async def collect() -> str:
+        return "".join([text async for text in stream_content(prompt, model, timeout)])
+
+    return await asyncio.wait_for(collect(), timeout=timeout)
+
+
+async def _hedged_attempt(prompt: str, model: str, deadline: float) -> str:
+    """
+    Run one attempt, hedging with a second request if the first is slower than p95.
+
+    The first request to finish wins and the other is cancelled. Hedges are
+    limited by the hedge budget and charged to the global admission buckets,
+    and are skipped when those have no room.
+    """
+    primary = asyncio.create_task(_attempt(prompt, model, deadline - time.monotonic()))
+    hedge = None
+    hedge_budget.deposit()
+    try:
+        p95 = latency_tracker.quantile(0.95) if GEMINI_HEDGE_ENABLED else None
+        if p95 is None:
+            return await primary
+
+        hedge_delay = max(p95, GEMINI_HEDGE_MIN_DELAY_MS / 1000)
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        # Only hedge if the second request still has a realistic chance to finish in time
+        if done or deadline - time.monotonic() < GEMINI_MIN_ATTEMPT_MS / 1000:
+            return await primary
+        if not hedge_budget.try_spend():
+            gemini_hedges_skipped_total.inc("budget")
+            return await primary
+        if not gemini_admission.try_take_global(estimate_tokens(prompt)):
+            # The hedge was never sent, so it doesn't count against the budget
+            hedge_budget.refund()
+            gemini_hedges_skipped_total.inc("admission")
+            return await primary
+
+        gemini_hedges_total.inc()
+        hedge = asyncio.create_task(_attempt(prompt, model, deadline - time.monotonic()))
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        gemini_hedge_wins_total.inc()
+                    return task.result()
+        # Both failed, surface the primary's error
+        return primary.result()
+    finally:
+        # Cancel whichever request lost, or both if the caller went away
+        primary.cancel()
+        if hedge is not None:
+            hedge.cancel()
+
+
+async def generate_content(prompt: str, deadline: Optional[float] = None, model: str = GEMINI_MODEL) -> str:
+    """
+    Query Gemini and return the full response text.
+
+    ``deadline`` is an absolute ``time.monotonic()`` timestamp; retryable errors
+    are retried with jittered exponential backoff while the remaining budget
+    allows another attempt.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + GEMINI_DEFAULT_TIMEOUT_MS / 1000
+    attempt = 0
+    while True:
+        if deadline <= time.monotonic():
+            raise DeadlineExceeded("Deadline exceeded before Gemini responded")
+        try:
+            return await _hedged_attempt(prompt, model, deadline)
+        except Exception as e:
+            # Full jitter keeps retries from many callers from synchronising
+            backoff = random.uniform(0, min(GEMINI_RETRY_MAX_MS, GEMINI_RETRY_BASE_MS * 2 ** attempt) / 1000)
+            retry = (
+                is_retryable(e)
+                and attempt < GEMINI_MAX_RETRIES
+                and deadline - time.monotonic() - backoff >= GEMINI_MIN_ATTEMPT_MS / 1000
+            )
+            if not retry:
+                if isinstance(e, asyncio.TimeoutError):
+                    raise DeadlineExceeded("Deadline exceeded before Gemini responded") from e
+                raise
+            gemini_retries_total.inc(_retry_reason(e))
+            attempt += 1
+            await asyncio.sleep(backoff)
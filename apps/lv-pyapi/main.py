@@ -1,21 +1,46 @@
-from fastapi import FastAPI, Depends, HTTPException, Body
+from fastapi import FastAPI, Depends, HTTPException, Body, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 from sqlalchemy import select
-from typing import List
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Optional
 import uvicorn
 import os
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
-from google import genai
 
-from database import get_db
+import gemini
+from admin import router as admin_router
+from auth import get_optional_user, router as auth_router
+from conversations import router as conversations_router
+from admission import (AdmissionRejected, caller_id, estimate_tokens, gemini_admission,
+                       request_deadline, request_priority)
+from batch import BATCH_MAX_CONCURRENCY, BATCH_MAX_PROMPTS, stream_batch
+from caching import cache_headers, is_conditional, not_modified, not_modified_response, validators_for
+from chat import router as chat_router
+from maintenance import start_maintenance
+from database import ReadYourWritesMiddleware, get_read_db, mark_write
+from metrics import MetricsMiddleware, PROMETHEUS_CONTENT_TYPE, render_latest
 from python_utils.sqlalchemy_models import User
+from write_behind import conversation_writer
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background maintenance jobs and conversation persistence for the lifetime of the app"""
+    await conversation_writer.start()
+    tasks = start_maintenance()
+    yield
+    for task in tasks:
+        task.cancel()
+    await conversation_writer.stop()
+
 # Create FastAPI app
-app = FastAPI(title="LV PyAPI", description="Living Vectors Python API", version="1.0.0")
+app = FastAPI(title="LV PyAPI", description="Living Vectors Python API", version="1.0.0", lifespan=lifespan)
 allowed_origins = [origin.strip() for origin in os.getenv("FRONTEND_ORIGINS", "").split(",") if origin.strip()]
 
 app.add_middleware(
@@ -25,8 +50,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ReadYourWritesMiddleware)
+# Added last so it is the outermost middleware and times the whole request
+app.add_middleware(MetricsMiddleware)
+app.include_router(admin_router)
+app.include_router(auth_router)
+app.include_router(conversations_router)
+app.include_router(chat_router)
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+        content={"message": f"Too many requests ({exc.reason})", "status": 429},
+    )
 
 @app.get("/")
 async def hello():
@@ -38,10 +76,24 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "lv-pyapi"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus metrics endpoint"""
+    return Response(content=render_latest(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 @app.get("/users/{user_id}")
-async def get_user(user_id: str, db: Session = Depends(get_db)):
-    """Get a specific user by ID"""
+def get_user(user_id: str, request: Request, db: Session = Depends(get_read_db)):
+    """Get a specific user by ID; a plain def so both queries run in the thread pool"""
     try:
+        # Revalidate from updatedAt alone before loading the full row
+        if is_conditional(request):
+            updated_at = db.execute(select(User.updatedAt).where(User.id == user_id)).scalar_one_or_none()
+            if updated_at is None:
+                raise HTTPException(status_code=404, detail="User not found")
+            validators = validators_for("user", user_id, updated_at.isoformat(), last_modified=updated_at)
+            if not_modified(request, validators):
+                return not_modified_response(validators)
+
         # Query specific user by ID
         stmt = select(User).where(User.id == user_id)
         result = db.execute(stmt)
@@ -50,11 +102,15 @@ async def get_user(user_id: str, db: Session = Depends(get_db)):
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        return {
-            "id": str(user.id),
-            "email": user.email,
-            "name": user.name,
-        }
+        validators = validators_for("user", user_id, user.updatedAt.isoformat(), last_modified=user.updatedAt)
+        return JSONResponse(
+            content={
+                "id": str(user.id),
+                "email": user.email,
+                "name": user.name,
+            },
+            headers=cache_headers(validators),
+        )
         
     except HTTPException:
         raise
@@ -62,16 +118,51 @@ async def get_user(user_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 @app.post("/api/gemini")
-def get_gemini_response(prompt: str = Body(..., embed=True)):
+async def get_gemini_response(
+    request: Request,
+    prompt: str = Body(..., embed=True),
+    user_id: Optional[str] = Depends(get_optional_user),
+):
     """Query Gemini API"""
-    try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        return {"message": response.text, "status": 200}
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"message": str(e), "status": 500})
+    deadline = request_deadline(request)
+    prompt_at = datetime.utcnow()
+    async with gemini_admission.admit(
+        caller_id(request, user_id), estimate_tokens(prompt), request_priority(request), deadline
+    ):
+        try:
+            message = await gemini.generate_content(prompt, deadline)
+            # Written behind the response, so the database never adds to its latency
+            if user_id is not None:
+                conversation_writer.record_exchange(user_id, prompt, prompt_at, message, datetime.utcnow())
+                mark_write(request)
+            return {"message": message, "status": 200}
+        except gemini.DeadlineExceeded as e:
+            return JSONResponse(status_code=504, content={"message": str(e), "status": 504})
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"message": str(e), "status": 500})
+
+class GeminiBatchRequest(BaseModel):
+    prompts: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_PROMPTS)
+    concurrency: int = Field(BATCH_MAX_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY)
+
+@app.post("/api/gemini/batch")
+async def get_gemini_batch_response(
+    request: Request,
+    batch: GeminiBatchRequest,
+    user_id: Optional[str] = Depends(get_optional_user),
+):
+    """Query Gemini API for many prompts, streaming NDJSON results in completion order"""
+    return StreamingResponse(
+        stream_batch(
+            batch.prompts,
+            gemini.generate_content,
+            gemini_admission,
+            caller_id(request, user_id),
+            concurrency=batch.concurrency,
+            deadline=request_deadline(request),
+        ),
+        media_type="application/x-ndjson",
+    )
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
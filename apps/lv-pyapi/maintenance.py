@@ -0,0 +1,451 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import delete, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from starlette.concurrency import run_in_threadpool
+
+from database import engine
+from metrics import (maintenance_partition_rows_moved_total, maintenance_partitions_total,
+                     maintenance_rows_purged_total, maintenance_runs_total, maintenance_stats_users_rebuilt_total)
+from python_utils.sqlalchemy_models import (ConversationMessage, ConversationStats, Session as UserSession, User,
+                                            VerificationToken)
+
+logger = logging.getLogger(__name__)
+
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "true").lower() == "true"
+PURGE_INTERVAL_S = float(os.getenv("PURGE_INTERVAL_S", "3600"))
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+PURGE_BASE_SLEEP_MS = int(os.getenv("PURGE_BASE_SLEEP_MS", "100"))
+PURGE_MAX_SLEEP_MS = int(os.getenv("PURGE_MAX_SLEEP_MS", "10000"))
+PURGE_MAX_REPLICATION_LAG_S = float(os.getenv("PURGE_MAX_REPLICATION_LAG_S", "5"))
+PURGE_MAX_RUN_S = float(os.getenv("PURGE_MAX_RUN_S", "600"))
+STATS_REBUILD_BATCH_SIZE = int(os.getenv("STATS_REBUILD_BATCH_SIZE", "200"))
+PARTITION_INTERVAL_S = float(os.getenv("PARTITION_INTERVAL_S", "86400"))
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_LOCK_TIMEOUT_MS = int(os.getenv("PARTITION_LOCK_TIMEOUT_MS", "5000"))
+# Months of conversation history to keep; 0 keeps everything
+MESSAGE_RETENTION_MONTHS = int(os.getenv("MESSAGE_RETENTION_MONTHS", "0"))
+# "detach" moves expired partitions to the archive schema, "drop" deletes them
+PARTITION_EXPIRED_ACTION = os.getenv("PARTITION_EXPIRED_ACTION", "detach")
+PARTITION_ARCHIVE_SCHEMA = os.getenv("PARTITION_ARCHIVE_SCHEMA", "archive")
+
+# Advisory lock ids, one per maintenance job, shared by every replica
+PURGE_ADVISORY_LOCK_ID = 7_401_032_001
+STATS_REBUILD_ADVISORY_LOCK_ID = 7_401_034_001
+PARTITION_ADVISORY_LOCK_ID = 7_401_040_001
+
+PARTITIONED_TABLE = ConversationMessage.__tablename__
+_PARTITION_NAME = re.compile(rf"^{PARTITIONED_TABLE}_p(\d{{4}})(\d{{2}})$")
+
+PURGE_MODELS = (
+    (UserSession, (UserSession.sessionToken,)),
+    (VerificationToken, (VerificationToken.identifier, VerificationToken.token)),
+)
+
+last_results: Dict[str, Dict[str, Any]] = {}
+
+
+def _load_signals(conn) -> Dict[str, float]:
+    """Replication lag on the primary and the number of sessions waiting on locks"""
+    lag = conn.execute(text(
+        "SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) FROM pg_stat_replication"
+    )).scalar_one()
+    lock_waiters = conn.execute(text(
+        "SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'"
+    )).scalar_one()
+    return {"replication_lag": float(lag), "lock_waiters": int(lock_waiters)}
+
+
+def next_sleep(current: float, signals: Dict[str, float]) -> float:
+    """
+    Adapt the pause between batches to how the primary is coping.
+
+    Back off multiplicatively while replicas lag or sessions queue on locks,
+    and recover gradually towards the base pause once they clear.
+    """
+    base = PURGE_BASE_SLEEP_MS / 1000
+    ceiling = PURGE_MAX_SLEEP_MS / 1000
+    if signals["replication_lag"] > PURGE_MAX_REPLICATION_LAG_S or signals["lock_waiters"] > 0:
+        return min(ceiling, max(current, base) * 2)
+    return max(base, current / 2)
+
+
+def _purge_batch(conn, model, key_columns, cutoff: datetime, after: Optional[tuple]) -> List[tuple]:
+    """Delete one keyset-ordered batch of expired rows, skipping rows other sessions hold"""
+    order = (model.expires, *key_columns)
+    candidates = select(*order).where(model.expires < cutoff)
+    if after is not None:
+        candidates = candidates.where(tuple_(*order) > tuple_(*after))
+    candidates = candidates.order_by(*order).limit(PURGE_BATCH_SIZE).with_for_update(skip_locked=True)
+    stmt = (
+        delete(model)
+        .where(tuple_(*order).in_(candidates))
+        .returning(*order)
+    )
+    with conn.begin():
+        return [tuple(row) for row in conn.execute(stmt)]
+
+
+def purge_expired(sleep: Callable[[float], None] = time.sleep) -> Optional[Dict[str, int]]:
+    """
+    Purge expired Session and VerificationToken rows in small batches.
+
+    Returns rows purged per table, or None if another replica holds the lock.
+    """
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None)
+    purged: Dict[str, int] = {}
+    started = time.monotonic()
+    with engine.connect() as conn:
+        locked = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": PURGE_ADVISORY_LOCK_ID}).scalar_one()
+        conn.commit()
+        if not locked:
+            maintenance_runs_total.inc("purge_expired", "skipped")
+            return None
+        try:
+            pause = PURGE_BASE_SLEEP_MS / 1000
+            for model, key_columns in PURGE_MODELS:
+                table = model.__tablename__
+                purged[table] = 0
+                after = None
+                while time.monotonic() - started < PURGE_MAX_RUN_S:
+                    rows = _purge_batch(conn, model, key_columns, cutoff, after)
+                    if not rows:
+                        break
+                    purged[table] += len(rows)
+                    maintenance_rows_purged_total.inc(table, amount=len(rows))
+                    after = max(rows)
+                    if len(rows) < PURGE_BATCH_SIZE:
+                        break
+                    with conn.begin():
+                        pause = next_sleep(pause, _load_signals(conn))
+                    sleep(pause)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": PURGE_ADVISORY_LOCK_ID})
+            conn.commit()
+
+    maintenance_runs_total.inc("purge_expired", "completed")
+    last_results["purge_expired"] = {
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "duration_s": round(time.monotonic() - started, 3),
+        "rows_purged": purged,
+    }
+    logger.info(f"Purged expired rows: {purged}")
+    return purged
+
+
+# Recount a batch of users from ConversationMessage. Callers lock the stats rows
+# first, so trigger updates from concurrent inserts queue behind the recount and
+# apply on top of it instead of being lost or counted twice.
+_RECOUNT_STATS = text("""
+    UPDATE "public"."ConversationStats" AS s SET
+        "userMessageCount" = a.user_count,
+        "aiMessageCount" = a.ai_count,
+        "totalCharacters" = a.characters,
+        "lastMessageAt" = a.last_message_at,
+        "updatedAt" = now()
+    FROM (
+        SELECT ids."userId",
+               count(m."messageId") FILTER (WHERE m."sender" = 'USER') AS user_count,
+               count(m."messageId") FILTER (WHERE m."sender" = 'AI') AS ai_count,
+               COALESCE(sum(length(m."content")), 0) AS characters,
+               max(m."createdAt") AS last_message_at
+        FROM unnest(CAST(:user_ids AS uuid[])) AS ids("userId")
+        LEFT JOIN "public"."ConversationMessage" m ON m."userId" = ids."userId"
+        GROUP BY ids."userId"
+    ) AS a
+    WHERE s."userId" = a."userId"
+""")
+
+
+def _rebuild_stats_batch(conn, after: Optional[str]) -> List[str]:
+    """Recount ConversationStats for the next keyset batch of users, one short transaction"""
+    with conn.begin():
+        users = select(User.id).order_by(User.id).limit(STATS_REBUILD_BATCH_SIZE)
+        if after is not None:
+            users = users.where(User.id > after)
+        user_ids = [str(user_id) for user_id in conn.execute(users).scalars()]
+        if not user_ids:
+            return []
+        conn.execute(
+            insert(ConversationStats)
+            .values([{"userId": user_id} for user_id in user_ids])
+            .on_conflict_do_nothing(index_elements=[ConversationStats.userId])
+        )
+        # Lock in key order, like the triggers do, so neither side can deadlock
+        conn.execute(
+            select(ConversationStats.userId)
+            .where(ConversationStats.userId.in_(user_ids))
+            .order_by(ConversationStats.userId)
+            .with_for_update()
+        )
+        conn.execute(_RECOUNT_STATS, {"user_ids": user_ids})
+    return user_ids
+
+
+def rebuild_conversation_stats(after: Optional[str] = None,
+                               sleep: Callable[[float], None] = time.sleep) -> Optional[int]:
+    """
+    Backfill or repair ConversationStats online, a batch of users at a time.
+
+    Safe to run while messages are being written; ``after`` resumes from the
+    last user id of an interrupted run. Returns the number of users rebuilt,
+    or None if another replica holds the lock.
+    """
+    rebuilt = 0
+    started = time.monotonic()
+    with engine.connect() as conn:
+        locked = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": STATS_REBUILD_ADVISORY_LOCK_ID}).scalar_one()
+        conn.commit()
+        if not locked:
+            maintenance_runs_total.inc("rebuild_conversation_stats", "skipped")
+            return None
+        try:
+            pause = PURGE_BASE_SLEEP_MS / 1000
+            while True:
+                user_ids = _rebuild_stats_batch(conn, after)
+                if not user_ids:
+                    break
+                rebuilt += len(user_ids)
+                maintenance_stats_users_rebuilt_total.inc(amount=len(user_ids))
+                after = user_ids[-1]
+                last_results["rebuild_conversation_stats"] = {"running": True, "users_rebuilt": rebuilt, "last_user_id": after}
+                if len(user_ids) < STATS_REBUILD_BATCH_SIZE:
+                    break
+                with conn.begin():
+                    pause = next_sleep(pause, _load_signals(conn))
+                sleep(pause)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": STATS_REBUILD_ADVISORY_LOCK_ID})
+            conn.commit()
+
+    maintenance_runs_total.inc("rebuild_conversation_stats", "completed")
+    last_results["rebuild_conversation_stats"] = {
+        "running": False,
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "duration_s": round(time.monotonic() - started, 3),
+        "users_rebuilt": rebuilt,
+        "last_user_id": after,
+    }
+    logger.info(f"Rebuilt conversation stats for {rebuilt} users")
+    return rebuilt
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITIONED_TABLE}_p{month:%Y%m}"
+
+
+def expired_partitions(names: List[str], today: date, retention_months: int = MESSAGE_RETENTION_MONTHS) -> List[str]:
+    """Monthly partitions whose whole month is older than the retention window"""
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(today.replace(day=1), -retention_months)
+    expired = []
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match and add_months(date(int(match[1]), int(match[2]), 1), 1) <= cutoff:
+            expired.append(name)
+    return sorted(expired)
+
+
+# Per-user totals of a partition, staged in a temporary table before any lock
+# is taken; an expired month receives no writes, so they stay accurate
+_STAGE_PARTITION_STATS = """
+    CREATE TEMPORARY TABLE partition_stats_delta AS
+    SELECT "userId",
+           count(*) FILTER (WHERE "sender" = 'USER') AS user_count,
+           count(*) FILTER (WHERE "sender" = 'AI') AS ai_count,
+           sum(length("content")) AS characters
+    FROM "public"."{partition}"
+    GROUP BY "userId"
+"""
+
+# Take the staged totals out of ConversationStats; detaching or dropping a
+# partition bypasses the delete trigger. A primary-key update per affected user.
+_SUBTRACT_PARTITION_STATS = """
+    UPDATE "public"."ConversationStats" AS s SET
+        "userMessageCount" = s."userMessageCount" - d.user_count,
+        "aiMessageCount" = s."aiMessageCount" - d.ai_count,
+        "totalCharacters" = s."totalCharacters" - d.characters,
+        "lastMessageAt" = CASE
+            WHEN s."userMessageCount" + s."aiMessageCount" = d.user_count + d.ai_count THEN NULL
+            ELSE s."lastMessageAt"
+        END,
+        "updatedAt" = now()
+    FROM partition_stats_delta AS d
+    WHERE s."userId" = d."userId"
+"""
+
+
+def _list_partitions(conn) -> List[str]:
+    return list(conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:parent AS regclass)"
+    ), {"parent": f'"public"."{PARTITIONED_TABLE}"'}).scalars())
+
+
+def _create_partition(conn, month: date) -> int:
+    """Create and attach one month's partition, returning how many rows it took over from the default partition"""
+    name = partition_name(month)
+    default = f"{PARTITIONED_TABLE}_default"
+    bounds = f"FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    in_range = f""""createdAt" >= '{month.isoformat()}' AND "createdAt" < '{add_months(month, 1).isoformat()}'"""
+    with conn.begin():
+        conn.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT_MS}ms'"))
+        # Attaching a separately created table takes a weaker lock on the parent
+        # than CREATE TABLE ... PARTITION OF, so writes keep flowing
+        conn.execute(text(
+            f'CREATE TABLE "public"."{name}" '
+            f'(LIKE "public"."{PARTITIONED_TABLE}" INCLUDING DEFAULTS INCLUDING GENERATED)'
+        ))
+        moved = 0
+        stranded = conn.execute(text(
+            f'SELECT EXISTS (SELECT 1 FROM "public"."{default}" WHERE {in_range})'
+        )).scalar_one()
+        if stranded:
+            # Maintenance fell behind and the month's messages landed in the default
+            # partition, where ATTACH would reject them; move them across first.
+            # Direct writes to partitions skip the parent's stats triggers, which
+            # is right since the messages only change tables.
+            conn.execute(text(f'LOCK TABLE "public"."{default}" IN SHARE ROW EXCLUSIVE MODE'))
+            moved = conn.execute(text(
+                f'INSERT INTO "public"."{name}" ("messageId", "userId", "sender", "content", "createdAt") '
+                f'SELECT "messageId", "userId", "sender", "content", "createdAt" '
+                f'FROM "public"."{default}" WHERE {in_range}'
+            )).rowcount
+            conn.execute(text(f'DELETE FROM "public"."{default}" WHERE {in_range}'))
+            logger.warning(f"Moved {moved} messages from {default} into {name}; partition maintenance fell behind")
+        conn.execute(text(
+            f'ALTER TABLE "public"."{PARTITIONED_TABLE}" ATTACH PARTITION "public"."{name}" FOR VALUES {bounds}'
+        ))
+    return moved
+
+
+def _retire_partition(conn, name: str) -> None:
+    """
+    Detach an expired partition, then archive or drop it.
+
+    The month is scanned for its stats before any lock is taken, so the
+    transaction holding the parent's ACCESS EXCLUSIVE lock only detaches and
+    applies the staged totals by primary key.
+    """
+    with conn.begin():
+        # Pooled connections keep temporary tables, so clear any left by a failed run
+        conn.execute(text("DROP TABLE IF EXISTS pg_temp.partition_stats_delta"))
+        conn.execute(text(_STAGE_PARTITION_STATS.format(partition=name)))
+    try:
+        with conn.begin():
+            conn.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT_MS}ms'"))
+            # Detach first so no stats rows are held locked while waiting for the parent
+            conn.execute(text(f'ALTER TABLE "public"."{PARTITIONED_TABLE}" DETACH PARTITION "public"."{name}"'))
+            conn.execute(text(_SUBTRACT_PARTITION_STATS))
+            if PARTITION_EXPIRED_ACTION == "drop":
+                conn.execute(text(f'DROP TABLE "public"."{name}"'))
+            else:
+                # Outside the public schema, archived partitions stay out of typegen
+                conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{PARTITION_ARCHIVE_SCHEMA}"'))
+                conn.execute(text(f'ALTER TABLE "public"."{name}" SET SCHEMA "{PARTITION_ARCHIVE_SCHEMA}"'))
+    finally:
+        with conn.begin():
+            conn.execute(text("DROP TABLE IF EXISTS pg_temp.partition_stats_delta"))
+
+
+def manage_partitions(today: Optional[date] = None) -> Optional[Dict[str, List[str]]]:
+    """
+    Keep ConversationMessage partitions ahead of time and retire expired ones.
+
+    Creates monthly partitions up to PARTITION_MONTHS_AHEAD months out, and
+    detaches or drops partitions past MESSAGE_RETENTION_MONTHS. Returns the
+    partitions changed, or None if another replica holds the lock.
+    """
+    today = today or datetime.now(timezone.utc).date()
+    started = time.monotonic()
+    changed: Dict[str, List[str]] = {"created": [], "retired": [], "failed": []}
+    with engine.connect() as conn:
+        locked = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": PARTITION_ADVISORY_LOCK_ID}).scalar_one()
+        conn.commit()
+        if not locked:
+            maintenance_runs_total.inc("manage_partitions", "skipped")
+            return None
+        try:
+            existing = set(_list_partitions(conn))
+            conn.commit()
+            current = today.replace(day=1)
+            for offset in range(PARTITION_MONTHS_AHEAD + 1):
+                month = add_months(current, offset)
+                if partition_name(month) in existing:
+                    continue
+                try:
+                    moved = _create_partition(conn, month)
+                    changed["created"].append(partition_name(month))
+                    maintenance_partitions_total.inc("created")
+                    maintenance_partition_rows_moved_total.inc(amount=moved)
+                except Exception as e:
+                    # Typically a lock timeout; the next run tries again
+                    changed["failed"].append(partition_name(month))
+                    maintenance_partitions_total.inc("failed")
+                    logger.warning(f"Could not create partition {partition_name(month)}: {e}")
+
+            for name in expired_partitions(sorted(existing), today):
+                try:
+                    _retire_partition(conn, name)
+                    changed["retired"].append(name)
+                    maintenance_partitions_total.inc("dropped" if PARTITION_EXPIRED_ACTION == "drop" else "detached")
+                except Exception as e:
+                    changed["failed"].append(name)
+                    maintenance_partitions_total.inc("failed")
+                    logger.warning(f"Could not retire partition {name}: {e}")
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": PARTITION_ADVISORY_LOCK_ID})
+            conn.commit()
+
+    maintenance_runs_total.inc("manage_partitions", "completed")
+    last_results["manage_partitions"] = {
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "duration_s": round(time.monotonic() - started, 3),
+        **changed,
+    }
+    logger.info(f"Managed ConversationMessage partitions: {changed}")
+    return changed
+
+
+async def run_periodically(name: str, job: Callable[[], Any], interval: float) -> None:
+    """Run a blocking job in the thread pool every ``interval`` seconds, with jitter"""
+    while True:
+        # Jitter spreads replicas out so they don't all contend for the lock at once
+        await asyncio.sleep(interval * random.uniform(0.9, 1.1))
+        try:
+            await run_in_threadpool(job)
+        except Exception:
+            maintenance_runs_total.inc(name, "failed")
+            logger.exception(f"Maintenance job {name} failed")
+
+
+def start_maintenance() -> List[asyncio.Task]:
+    """Start the background maintenance jobs"""
+    if not MAINTENANCE_ENABLED:
+        return []
+    return [
+        asyncio.create_task(run_periodically("purge_expired", purge_expired, PURGE_INTERVAL_S)),
+        asyncio.create_task(run_periodically("manage_partitions", manage_partitions, PARTITION_INTERVAL_S)),
+    ]
+
+
+if __name__ == "__main__":
+    # One-off backfill, e.g. after the ConversationStats migration:
+    #   python -m maintenance [after-user-id]
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    rebuild_conversation_stats(sys.argv[1] if len(sys.argv) > 1 else None)
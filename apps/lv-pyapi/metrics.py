@@ -0,0 +1,393 @@
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+# Default latency buckets in seconds, from sub-millisecond queries up to long LLM calls
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+COUNT_BUCKETS: Tuple[float, ...] = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """
+    Base class for metrics with thread-sharded storage.
+
+    Every thread writes only to its own shard, so the hot path needs no lock;
+    shards are merged when the registry is scraped.
+    """
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # list.append is atomic, a new thread registers its shard without locking
+            self._shards.append(shard)
+            return shard
+
+    def _snapshots(self) -> List[dict]:
+        return [shard.copy() for shard in list(self._shards)]
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.collect())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+    type_name = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return sum(snapshot.get(labels, 0) for snapshot in self._snapshots())
+
+    def collect(self) -> List[str]:
+        totals: Dict[tuple, float] = {}
+        for snapshot in self._snapshots():
+            for labels, value in snapshot.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(totals.items())
+        ]
+
+
+class Gauge(Counter):
+    """
+    Gauge that moves up and down, or reports the result of a callback.
+
+    Increments and decrements from different threads land in different shards
+    and still sum to the right value.
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def value(self, *labels: str) -> float:
+        if self._function is not None:
+            return self._function()
+        return super().value(*labels)
+
+    def collect(self) -> List[str]:
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        return super().collect()
+
+
+class Histogram(_Metric):
+    """Histogram with fixed buckets"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        # Layout: [count per bucket..., sum, count]
+        state = shard.get(labels)
+        if state is None:
+            state = shard[labels] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[index] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def _merged(self) -> Dict[tuple, List[float]]:
+        merged: Dict[tuple, List[float]] = {}
+        for snapshot in self._snapshots():
+            for labels, state in snapshot.items():
+                state = list(state)
+                total = merged.get(labels)
+                if total is None:
+                    merged[labels] = state
+                else:
+                    merged[labels] = [a + b for a, b in zip(total, state)]
+        return merged
+
+    def count(self, *labels: str) -> int:
+        state = self._merged().get(labels)
+        return int(state[-1]) if state else 0
+
+    def sum(self, *labels: str) -> float:
+        state = self._merged().get(labels)
+        return state[-2] if state else 0.0
+
+    def collect(self) -> List[str]:
+        lines = []
+        for labels, state in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, state):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{label_str} {int(state[-1])}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+# HTTP metrics
+http_requests_total = registry.counter(
+    "lv_pyapi_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = registry.histogram(
+    "lv_pyapi_http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+http_requests_in_flight = registry.gauge(
+    "lv_pyapi_http_requests_in_flight", "HTTP requests currently being served", ("method",))
+
+# Database metrics
+db_query_duration = registry.histogram(
+    "lv_pyapi_db_query_duration_seconds", "Duration of individual SQL statements", ("route",))
+db_queries_per_request = registry.histogram(
+    "lv_pyapi_db_queries_per_request", "Number of SQL statements executed per request", ("route",),
+    buckets=COUNT_BUCKETS)
+db_time_per_request = registry.histogram(
+    "lv_pyapi_db_time_per_request_seconds", "Total SQL time spent per request", ("route",))
+db_reads_routed_total = registry.counter(
+    "lv_pyapi_db_reads_routed_total", "Statements routed by read sessions, by target", ("target",))
+db_replicas_healthy = registry.gauge(
+    "lv_pyapi_db_replicas_healthy", "Read replicas currently in rotation")
+
+# Gemini metrics
+gemini_request_duration = registry.histogram(
+    "lv_pyapi_gemini_request_duration_seconds", "Upstream Gemini call latency", ("model", "outcome"))
+gemini_time_to_first_token = registry.histogram(
+    "lv_pyapi_gemini_time_to_first_token_seconds", "Time until the first Gemini chunk arrives", ("model",))
+gemini_tokens_total = registry.counter(
+    "lv_pyapi_gemini_tokens_total", "Gemini token usage by kind", ("model", "kind"))
+gemini_retries_total = registry.counter(
+    "lv_pyapi_gemini_retries_total", "Gemini calls retried, by failure reason", ("reason",))
+gemini_hedges_total = registry.counter(
+    "lv_pyapi_gemini_hedges_total", "Hedged Gemini requests sent after the first exceeded p95")
+gemini_hedge_wins_total = registry.counter(
+    "lv_pyapi_gemini_hedge_wins_total", "Hedged Gemini requests that finished before the original")
+gemini_hedges_skipped_total = registry.counter(
+    "lv_pyapi_gemini_hedges_skipped_total", "Hedges not sent for lack of hedge budget or admission capacity",
+    ("reason",))
+
+# Admission control metrics
+admission_active = registry.gauge(
+    "lv_pyapi_admission_active_requests", "Admitted requests currently holding a slot")
+admission_queue_depth = registry.gauge(
+    "lv_pyapi_admission_queue_depth", "Requests waiting for an admission slot")
+admission_rejections_total = registry.counter(
+    "lv_pyapi_admission_rejections_total", "Requests rejected by admission control", ("reason",))
+admission_deferrals_total = registry.counter(
+    "lv_pyapi_admission_deferrals_total", "Background requests told to retry later by admission control", ("reason",))
+admission_shared_failures_total = registry.counter(
+    "lv_pyapi_admission_shared_failures_total", "Shared rate limit leases that failed and were admitted locally")
+
+# Authentication metrics
+auth_cache_lookups_total = registry.counter(
+    "lv_pyapi_auth_cache_lookups_total", "Session token lookups by cache result", ("result",))
+
+# Maintenance metrics
+maintenance_runs_total = registry.counter(
+    "lv_pyapi_maintenance_runs_total", "Maintenance job runs by outcome", ("job", "outcome"))
+maintenance_rows_purged_total = registry.counter(
+    "lv_pyapi_maintenance_rows_purged_total", "Expired rows deleted by maintenance", ("table",))
+maintenance_stats_users_rebuilt_total = registry.counter(
+    "lv_pyapi_maintenance_stats_users_rebuilt_total", "Users whose conversation stats were recounted")
+maintenance_partitions_total = registry.counter(
+    "lv_pyapi_maintenance_partitions_total", "ConversationMessage partitions created, retired or failed", ("action",))
+maintenance_partition_rows_moved_total = registry.counter(
+    "lv_pyapi_maintenance_partition_rows_moved_total",
+    "Messages moved out of the default partition because their month's partition was created late")
+
+# Chat WebSocket metrics
+chat_connections_active = registry.gauge(
+    "lv_pyapi_chat_connections_active", "Open chat WebSocket connections on this worker")
+chat_connections_rejected_total = registry.counter(
+    "lv_pyapi_chat_connections_rejected_total", "Chat connections refused, by reason", ("reason",))
+chat_evictions_total = registry.counter(
+    "lv_pyapi_chat_evictions_total", "Chat connections closed by the server, by reason", ("reason",))
+chat_turns_total = registry.counter(
+    "lv_pyapi_chat_turns_total", "Chat turns by outcome", ("outcome",))
+
+# Write-behind conversation persistence metrics
+write_behind_queue_depth = registry.gauge(
+    "lv_pyapi_write_behind_queue_depth", "Conversation messages waiting to be written")
+write_behind_lag_seconds = registry.gauge(
+    "lv_pyapi_write_behind_lag_seconds", "Age of the oldest conversation message waiting to be written")
+write_behind_journal_bytes = registry.gauge(
+    "lv_pyapi_write_behind_journal_bytes", "Size of the local journal of unwritten conversation messages")
+write_behind_entries_total = registry.counter(
+    "lv_pyapi_write_behind_entries_total", "Conversation messages by outcome (written, spilled, replayed, dropped)",
+    ("outcome",))
+write_behind_write_lag = registry.histogram(
+    "lv_pyapi_write_behind_write_lag_seconds", "Time from enqueue to commit for conversation messages")
+
+
+class RequestStats:
+    """Per-request accumulator shared between the middleware and the SQL hooks"""
+    __slots__ = ("scope", "query_count", "query_time")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.query_count = 0
+        self.query_time = 0.0
+
+    @property
+    def route(self) -> str:
+        # FastAPI stores the matched route in the scope once routing is done
+        route = self.scope.get("route")
+        return route.path if route is not None else "<unmatched>"
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def current_route() -> str:
+    """Route template of the request being served, or a placeholder outside of requests"""
+    stats = current_request.get()
+    return stats.route if stats is not None else "<background>"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status and in-flight counts per route.
+
+    Routes are labelled with their template (``/users/{user_id}``) rather than the
+    raw path so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_flight.dec(method)
+            route = stats.route
+            http_request_duration.observe(elapsed, method, route)
+            http_requests_total.inc(method, route, str(status_code))
+            db_queries_per_request.observe(stats.query_count, route)
+            db_time_per_request.observe(stats.query_time, route)
+            current_request.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = current_request.get()
+    if stats is not None:
+        stats.query_count += 1
+        stats.query_time += elapsed
+    db_query_duration.observe(elapsed, current_route())
+
+
+def instrument_engine(engine) -> None:
+    """Attach query timing hooks to a SQLAlchemy engine"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def render_latest() -> str:
+    """Render all registered metrics in the Prometheus text format"""
+    return registry.render()
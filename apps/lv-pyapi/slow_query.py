@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import queue
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import create_engine, event
+
+from metrics import current_route
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0.2"))
+SLOW_QUERY_EXPLAIN_PER_MINUTE = int(os.getenv("SLOW_QUERY_EXPLAIN_PER_MINUTE", "6"))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "5000"))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv("SLOW_QUERY_BUFFER_SIZE", "200"))
+SLOW_QUERY_LOG_FILE = os.getenv(
+    "SLOW_QUERY_LOG_FILE", os.path.join(tempfile.gettempdir(), "lv-pyapi-slow-queries.log"))
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "5"))
+
+# EXPLAIN ANALYZE executes the statement, so it is only used for plain reads:
+# no row locks, no data-modifying CTEs or SELECT INTO, and no functions with
+# side effects such as session-level advisory locks that outlive the rollback
+_ANALYZABLE_PREFIXES = ("select", "with")
+_UNSAFE_TO_ANALYZE = re.compile(
+    r"\bfor\s+(?:no\s+key\s+update|update|key\s+share|share)\b"
+    r"|\b(?:insert|update|delete|merge|into)\b"
+    r"|\b(?:pg_\w*(?:lock|advisory)\w*|nextval|setval|set_config|pg_sleep|pg_cancel_backend"
+    r"|pg_terminate_backend|dblink\w*)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def is_analyzable(statement: str) -> bool:
+    """Whether a statement is a plain read that EXPLAIN ANALYZE can safely execute"""
+    return (statement.lstrip().lower().startswith(_ANALYZABLE_PREFIXES)
+            and _UNSAFE_TO_ANALYZE.search(statement) is None)
+
+
+def redact_parameters(parameters: Any) -> Any:
+    """Replace parameter values with their type names so no user data is logged"""
+    if isinstance(parameters, dict):
+        return {key: f"<{type(value).__name__}>" for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [f"<{type(value).__name__}>" for value in parameters]
+    return None
+
+
+class _RateLimiter:
+    """Token bucket allowing ``per_minute`` events per minute"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.refill_per_second = per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class SlowQueryLog:
+    """
+    Records statements slower than a threshold and captures their plans.
+
+    Slow statements are appended to a bounded ring buffer and a rotating log
+    file. A sampled, rate-limited subset is re-run under ``EXPLAIN`` by a
+    background thread on a single-connection engine for the server that ran
+    the statement, so plan capture never blocks the request, cannot add more
+    than a trickle of load and never moves replica reads onto the primary.
+    """
+
+    def __init__(self, database_url: str,
+                 threshold_ms: float = SLOW_QUERY_THRESHOLD_MS,
+                 sample_rate: float = SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+                 explain_per_minute: int = SLOW_QUERY_EXPLAIN_PER_MINUTE,
+                 buffer_size: int = SLOW_QUERY_BUFFER_SIZE,
+                 log_file: Optional[str] = SLOW_QUERY_LOG_FILE):
+        self.database_url = database_url
+        self.threshold = threshold_ms / 1000.0
+        self.sample_rate = sample_rate
+        self.entries: deque = deque(maxlen=buffer_size)
+        self._rate_limiter = _RateLimiter(explain_per_minute)
+        self._explain_queue: queue.Queue = queue.Queue(maxsize=max(explain_per_minute, 1))
+        self._explain_engines: Dict[Any, Any] = {}
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._file_logger = self._build_file_logger(log_file) if log_file else None
+
+    @staticmethod
+    def _build_file_logger(log_file: str) -> logging.Logger:
+        file_logger = logging.getLogger(f"{__name__}.file")
+        file_logger.propagate = False
+        file_logger.setLevel(logging.INFO)
+        if not file_logger.handlers:
+            try:
+                handler = RotatingFileHandler(
+                    log_file, maxBytes=SLOW_QUERY_LOG_MAX_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS)
+            except OSError as e:
+                logger.warning(f"Slow query log file disabled: {e}")
+                return file_logger
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            file_logger.addHandler(handler)
+        return file_logger
+
+    def install(self, engine) -> None:
+        """Attach the timing hooks to an engine"""
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start_time", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["slow_query_start_time"].pop()
+        if elapsed >= self.threshold:
+            self.record(statement, parameters, elapsed, executemany, conn.engine.url)
+
+    def record(self, statement: str, parameters: Any, elapsed: float, executemany: bool = False,
+               database_url: Any = None) -> Dict[str, Any]:
+        """Record a slow statement and schedule plan capture if it is sampled"""
+        entry = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "route": current_route(),
+            "duration_ms": round(elapsed * 1000, 3),
+            "statement": statement,
+            "parameters": redact_parameters(parameters),
+            "plan": None,
+            "explain_status": "skipped",
+        }
+        self.entries.append(entry)
+
+        if (not executemany and random.random() < self.sample_rate
+                and self._rate_limiter.allow()):
+            try:
+                self._explain_queue.put_nowait((entry, statement, parameters, database_url or self.database_url))
+                entry["explain_status"] = "pending"
+                self._ensure_worker()
+                return entry
+            except queue.Full:
+                pass
+        self._write(entry)
+        return entry
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent slow statements, newest first"""
+        return list(self.entries)[::-1][:limit]
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        if self._file_logger is not None:
+            self._file_logger.info(json.dumps(entry, default=str))
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="slow-query-explain", daemon=True)
+                self._worker.start()
+
+    def _get_explain_engine(self, database_url: Any):
+        explain_engine = self._explain_engines.get(database_url)
+        if explain_engine is None:
+            # A dedicated single connection per server keeps plan capture off the request pools
+            explain_engine = self._explain_engines[database_url] = create_engine(
+                database_url, pool_size=1, max_overflow=0)
+        return explain_engine
+
+    def _run(self) -> None:
+        while True:
+            entry, statement, parameters, database_url = self._explain_queue.get()
+            try:
+                entry["plan"] = self.explain(statement, parameters, database_url)
+                entry["explain_status"] = "captured"
+            except Exception as e:
+                entry["explain_status"] = "failed"
+                entry["explain_error"] = str(e)
+            self._write(entry)
+
+    def explain(self, statement: str, parameters: Any, database_url: Any = None) -> str:
+        """Run EXPLAIN for a statement on the server that executed it and return the plan text"""
+        options = "ANALYZE, BUFFERS, FORMAT TEXT" if is_analyzable(statement) else "FORMAT TEXT"
+        with self._get_explain_engine(database_url or self.database_url).connect() as conn:
+            # Always roll back, and bound the run time so a pathological plan can't pile up
+            with conn.begin() as transaction:
+                conn.exec_driver_sql(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS}")
+                result = conn.exec_driver_sql(f"EXPLAIN ({options}) {statement}", parameters or None)
+                plan = "\n".join(row[0] for row in result)
+                transaction.rollback()
+        return plan
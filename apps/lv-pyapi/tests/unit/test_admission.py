@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from starlette.requests import Request
+
+import admission
+from admission import (AdmissionController, AdmissionRejected, PRIORITIES, SharedWindowCounter, TokenBucket,
+                       request_priority)
+
+
+def test_token_bucket_reports_wait_time_when_empty():
+    bucket = TokenBucket(rate=1, capacity=2)
+    now = time.monotonic()
+    bucket.consume(2)
+    assert bucket.wait_time(1, now) == pytest.approx(1, abs=0.01)
+
+
+async def test_user_burst_is_rejected_with_retry_after():
+    controller = AdmissionController(user_rpm=60, user_burst=2)
+    for _ in range(2):
+        async with controller.admit("user", 10):
+            pass
+    with pytest.raises(AdmissionRejected) as exc_info:
+        await controller.acquire("user", 10)
+    assert exc_info.value.reason == "user_requests"
+    assert exc_info.value.retry_after >= 1
+    # Other users are unaffected
+    async with controller.admit("other", 10):
+        pass
+
+
+async def test_queued_requests_are_served_by_priority():
+    controller = AdmissionController(max_concurrent=1, queue_size=4, max_queue_wait=1, min_service_time=0)
+    await controller.acquire("holder", 1)
+    order = []
+
+    async def wait(name, priority):
+        await controller.acquire(name, 1, priority)
+        order.append(name)
+        controller.release()
+
+    tasks = [asyncio.create_task(wait("low", PRIORITIES["low"])),
+             asyncio.create_task(wait("high", PRIORITIES["high"]))]
+    await asyncio.sleep(0)
+    controller.release()
+    await asyncio.gather(*tasks)
+    assert order == ["high", "low"]
+
+
+async def test_unmeetable_deadline_is_rejected_immediately():
+    controller = AdmissionController(min_service_time=0.5)
+    with pytest.raises(AdmissionRejected) as exc_info:
+        await controller.acquire("user", 1, deadline=time.monotonic() + 0.1)
+    assert exc_info.value.reason == "deadline"
+
+
+async def test_shared_counter_outage_falls_back_to_local_limits(monkeypatch):
+    counter = SharedWindowCounter("test", 100)
+    attempts = []
+
+    def unreachable(window):
+        attempts.append(window)
+        raise OperationalError("SELECT 1", {}, Exception("connection refused"))
+
+    monkeypatch.setattr(counter, "_lease", unreachable)
+    controller = AdmissionController(user_rpm=60, user_burst=2, shared_counter=counter)
+    for _ in range(2):
+        async with controller.admit("user", 10):
+            pass
+    # The database is not retried on every request while it is down
+    assert len(attempts) == 1
+    with pytest.raises(AdmissionRejected) as exc_info:
+        await controller.acquire("user", 10)
+    assert exc_info.value.reason == "user_requests"
+
+
+async def test_cancelled_waiter_gets_its_rate_limit_refunded():
+    controller = AdmissionController(max_concurrent=1, queue_size=4, max_queue_wait=5, min_service_time=0,
+                                     user_rpm=60, user_burst=1)
+    await controller.acquire("holder", 1)
+    waiter = asyncio.create_task(controller.acquire("user", 1))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    controller.release()
+    async with controller.admit("user", 1):
+        pass
+
+
+def test_only_trusted_callers_get_high_priority(monkeypatch):
+    def request(**headers):
+        raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+        return Request({"type": "http", "headers": raw})
+
+    monkeypatch.setattr(admission, "ADMISSION_INTERNAL_TOKEN", "internal-secret")
+    assert request_priority(request(x_priority="high")) == PRIORITIES["normal"]
+    assert request_priority(request(x_priority="high", x_internal_token="guess")) == PRIORITIES["normal"]
+    assert request_priority(request(x_priority="low")) == PRIORITIES["low"]
+    assert request_priority(request(x_priority="high", x_internal_token="internal-secret")) == PRIORITIES["high"]
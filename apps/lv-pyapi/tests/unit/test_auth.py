@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import httpx
+
+import auth
+from auth import SessionTokenCache
+from main import app
+
+
+def make_loader(sessions):
+    calls = []
+
+    def loader(token):
+        calls.append(token)
+        time.sleep(0.05)
+        return sessions.get(token, (None, 0.0))
+
+    return loader, calls
+
+
+async def test_valid_and_invalid_tokens_are_cached():
+    loader, calls = make_loader({"good": ("user-1", 3600)})
+    cache = SessionTokenCache(loader=loader)
+    assert await cache.resolve("good") == "user-1"
+    assert await cache.resolve("good") == "user-1"
+    assert await cache.resolve("bad") is None
+    assert await cache.resolve("bad") is None
+    assert calls == ["good", "bad"]
+
+
+async def test_concurrent_lookups_share_one_query():
+    loader, calls = make_loader({"good": ("user-1", 3600)})
+    cache = SessionTokenCache(loader=loader)
+    results = await asyncio.gather(*(cache.resolve("good") for _ in range(10)))
+    assert results == ["user-1"] * 10
+    assert calls == ["good"]
+
+
+async def test_cache_respects_session_expiry_and_invalidation():
+    loader, calls = make_loader({"short": ("user-1", 0.01), "good": ("user-2", 3600)})
+    cache = SessionTokenCache(loader=loader)
+    await cache.resolve("short")
+    await asyncio.sleep(0.02)
+    await cache.resolve("short")
+    assert calls.count("short") == 2
+
+    await cache.resolve("good")
+    cache.invalidate("good")
+    await cache.resolve("good")
+    assert calls.count("good") == 2
+
+
+async def test_logged_out_token_resolves_to_none(monkeypatch):
+    sessions = {"good": ("user-1", 3600)}
+    loader, _ = make_loader(sessions)
+    cache = SessionTokenCache(loader=loader)
+    monkeypatch.setattr(auth, "session_cache", cache)
+    monkeypatch.setattr(auth, "delete_session", lambda token: sessions.pop(token))
+    assert await cache.resolve("good") == "user-1"
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post("/auth/logout", headers={"Authorization": "Bearer good"})
+    assert response.status_code == 200
+    assert await cache.resolve("good") is None
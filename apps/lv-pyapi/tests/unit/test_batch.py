@@ -0,0 +1,37 @@
+import asyncio
+import json
+import time
+
+from admission import AdmissionController
+from batch import stream_batch
+from metrics import admission_deferrals_total, admission_rejections_total
+
+
+async def fake_generate(prompt: str, deadline) -> str:
+    if prompt == "fail":
+        raise RuntimeError("upstream error")
+    if prompt == "slow":
+        await asyncio.sleep(0.2)
+    return prompt.upper()
+
+
+async def test_batch_streams_partial_results_in_completion_order():
+    controller = AdmissionController(user_burst=10)
+    lines = [json.loads(line) async for line in
+             stream_batch(["slow", "fail", "fast"], fake_generate, controller, "user", concurrency=3)]
+    assert [line["index"] for line in lines][-1] == 0
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[0] == {"index": 0, "status": 200, "message": "SLOW"}
+    assert by_index[1]["status"] == 500
+    assert by_index[2] == {"index": 2, "status": 200, "message": "FAST"}
+
+
+async def test_rejected_items_give_up_at_the_deadline_and_count_once():
+    controller = AdmissionController(user_rpm=1, user_burst=1, min_service_time=0)
+    deferred_before = admission_deferrals_total.value("user_requests")
+    rejected_before = admission_rejections_total.value("user_requests")
+    lines = [json.loads(line) async for line in stream_batch(
+        ["first", "second"], fake_generate, controller, "user", concurrency=1, deadline=time.monotonic() + 0.5)]
+    assert sorted(line["status"] for line in lines) == [200, 429]
+    assert admission_deferrals_total.value("user_requests") == deferred_before + 1
+    assert admission_rejections_total.value("user_requests") == rejected_before + 1
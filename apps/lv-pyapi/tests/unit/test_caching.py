@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from starlette.requests import Request
+
+from caching import cache_headers, not_modified, validators_for
+
+UPDATED_AT = datetime(2026, 10, 19, 9, 30, 15, 250000)
+
+
+def make_request(**headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_headers_carry_validators_and_cache_control():
+    validators = validators_for("user", "42", UPDATED_AT.isoformat(), last_modified=UPDATED_AT)
+    headers = cache_headers(validators, "private, max-age=30")
+    assert headers["ETag"].startswith('W/"')
+    assert headers["Last-Modified"] == "Mon, 19 Oct 2026 09:30:15 GMT"
+    assert headers["Cache-Control"] == "private, max-age=30"
+
+
+def test_etag_changes_with_version_and_variant():
+    base = validators_for("messages", "42", UPDATED_AT.isoformat(), "csv")
+    assert validators_for("messages", "42", UPDATED_AT.isoformat(), "ndjson").etag != base.etag
+    assert validators_for("messages", "42", datetime(2026, 10, 20).isoformat(), "csv").etag != base.etag
+
+
+def test_if_none_match_uses_weak_comparison_and_wins():
+    validators = validators_for("user", "42", UPDATED_AT.isoformat(), last_modified=UPDATED_AT)
+    strong = validators.etag.removeprefix("W/")
+    assert not_modified(make_request(if_none_match=f'"other", {strong}'), validators)
+    assert not_modified(make_request(if_none_match="*"), validators)
+    # A stale ETag means modified even if the date would say otherwise
+    assert not not_modified(make_request(if_none_match='"other"', if_modified_since="Tue, 20 Oct 2026 00:00:00 GMT"),
+                            validators)
+
+
+def test_if_modified_since_ignores_sub_second_precision():
+    validators = validators_for("user", "42", UPDATED_AT.isoformat(), last_modified=UPDATED_AT)
+    assert not_modified(make_request(if_modified_since="Mon, 19 Oct 2026 09:30:15 GMT"), validators)
+    assert not not_modified(make_request(if_modified_since="Mon, 19 Oct 2026 09:30:14 GMT"), validators)
+    assert not not_modified(make_request(if_modified_since="garbage"), validators)
+    assert not not_modified(make_request(), validators)
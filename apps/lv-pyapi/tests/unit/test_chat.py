@@ -0,0 +1,77 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import chat
+from main import app
+from python_utils.sqlalchemy_models import MessageSender
+
+
+class FakeSessionCache:
+    async def resolve(self, token):
+        return "user-1" if token == "good" else None
+
+
+@pytest.fixture
+def chat_env(monkeypatch):
+    saved = []
+
+    async def fake_stream(contents, model=None, timeout=None):
+        assert contents[-1].parts[0].text == "hello"
+        for text in ("Hi", " there"):
+            yield text
+
+    monkeypatch.setattr(chat, "session_cache", FakeSessionCache())
+    monkeypatch.setattr(chat, "load_history", lambda user_id: [(MessageSender.AI, "Are you dedicated?")])
+    monkeypatch.setattr(chat.conversation_writer, "record_exchange", lambda *args: saved.append(args))
+    monkeypatch.setattr(chat.gemini, "stream_content", fake_stream)
+    return saved
+
+
+def test_streams_tokens_and_saves_the_turn(chat_env):
+    client = TestClient(app)
+    with client.websocket_connect("/ws/chat", headers={"Authorization": "Bearer good"}) as ws:
+        ws.send_json({"type": "message", "content": " hello "})
+        assert ws.receive_json() == {"type": "token", "content": "Hi"}
+        assert ws.receive_json() == {"type": "token", "content": " there"}
+        assert ws.receive_json() == {"type": "done"}
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+    user_id, prompt, _, reply, _ = chat_env[0]
+    assert (user_id, prompt, reply) == ("user-1", "hello", "Hi there")
+    assert not chat.connections
+
+
+def test_rejects_unauthenticated_and_foreign_origins(chat_env):
+    client = TestClient(app)
+    with client.websocket_connect("/ws/chat") as ws:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == chat.CLOSE_POLICY_VIOLATION
+
+    headers = {"Authorization": "Bearer good", "Origin": "https://evil.example"}
+    with client.websocket_connect("/ws/chat", headers=headers) as ws:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == chat.CLOSE_POLICY_VIOLATION
+
+
+def test_caps_connections_per_worker(chat_env, monkeypatch):
+    monkeypatch.setattr(chat, "CHAT_MAX_CONNECTIONS", 0)
+    with TestClient(app).websocket_connect("/ws/chat", headers={"Authorization": "Bearer good"}) as ws:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == chat.CLOSE_TRY_AGAIN_LATER
+
+
+def test_eviction_waits_for_missed_heartbeats_and_idle_timeout():
+    connection = chat.ChatConnection(websocket=None, user_id="user-1")
+    now = time.monotonic()
+    assert connection.eviction_reason(now) is None
+    assert connection.eviction_reason(now + 2 * chat.CHAT_HEARTBEAT_INTERVAL_S + 1) == "heartbeat"
+    connection.last_seen = now + chat.CHAT_IDLE_TIMEOUT_S
+    assert connection.eviction_reason(now + chat.CHAT_IDLE_TIMEOUT_S + 1) == "idle"
+    connection.busy = True
+    assert connection.eviction_reason(now + chat.CHAT_IDLE_TIMEOUT_S + 1) is None
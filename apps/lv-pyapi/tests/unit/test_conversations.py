@@ -0,0 +1,96 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from auth import get_current_user
+from conversations import (accepts_gzip, decode_cursor, encode_cursor, encode_export, gzip_stream,
+                           render_snippet, stats_response)
+from main import app
+from python_utils.sqlalchemy_models import ConversationStats, MessageSender
+
+
+def test_stats_default_to_zero_for_users_without_messages():
+    assert stats_response("user-1", None) == {
+        "userId": "user-1",
+        "messageCount": 0,
+        "userMessageCount": 0,
+        "aiMessageCount": 0,
+        "totalCharacters": 0,
+        "lastMessageAt": None,
+    }
+
+
+def test_stats_sum_message_counts():
+    stats = ConversationStats(userMessageCount=3, aiMessageCount=2, totalCharacters=120,
+                              lastMessageAt=datetime(2026, 10, 19, 9, 30))
+    body = stats_response("user-1", stats)
+    assert body["messageCount"] == 5
+    assert body["totalCharacters"] == 120
+    assert body["lastMessageAt"] == "2026-10-19T09:30:00"
+
+
+def test_users_can_only_read_their_own_stats():
+    app.dependency_overrides[get_current_user] = lambda: "user-1"
+    try:
+        response = TestClient(app).get("/users/user-2/stats")
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 403
+
+
+def test_search_cursor_round_trips_and_rejects_garbage():
+    cursor = encode_cursor(0.0607927, "7f0c4ac6-2c4e-4e0b-9a55-3f2a1c9d8e11")
+    assert decode_cursor(cursor) == (0.0607927, "7f0c4ac6-2c4e-4e0b-9a55-3f2a1c9d8e11")
+    with pytest.raises(HTTPException) as error:
+        decode_cursor("not-a-cursor")
+    assert error.value.status_code == 400
+
+
+def test_snippets_are_escaped_before_highlighting():
+    headline = "run \ue000<script>\ue001 now"
+    assert render_snippet(headline) == "run <mark>&lt;script&gt;</mark> now"
+
+
+def _message(index):
+    return SimpleNamespace(
+        messageId=f"00000000-0000-0000-0000-{index:012d}",
+        sender=MessageSender.USER,
+        createdAt=datetime(2026, 10, 19, 9, 30),
+        content=f'said "hi", {index}',
+    )
+
+
+def test_export_encodes_each_batch_as_it_arrives():
+    batches = [[_message(1), _message(2)], [_message(3)]]
+    lines = b"".join(encode_export(iter(batches), "ndjson")).decode().splitlines()
+    assert [json.loads(line)["content"] for line in lines] == ['said "hi", 1', 'said "hi", 2', 'said "hi", 3']
+
+    chunks = encode_export(iter(batches), "csv")
+    assert next(chunks) == b"messageId,sender,createdAt,content\r\n"
+    rows = list(csv.reader(io.StringIO(b"".join(chunks).decode())))
+    assert rows[0] == ["00000000-0000-0000-0000-000000000001", "USER", "2026-10-19T09:30:00", 'said "hi", 1']
+    assert len(rows) == 3
+
+
+def test_accept_encoding_honours_q_values():
+    assert accepts_gzip("gzip, deflate, br")
+    assert accepts_gzip("br;q=1.0, gzip;q=0.8")
+    assert accepts_gzip("*")
+    assert not accepts_gzip("gzip;q=0")
+    assert not accepts_gzip("br, *;q=0")
+    assert not accepts_gzip("identity")
+    assert not accepts_gzip(None)
+
+
+def test_gzip_stream_emits_every_chunk_and_decompresses():
+    chunks = [b"first\n", b"second\n"]
+    compressed = list(gzip_stream(iter(chunks)))
+    assert len(compressed) == 3
+    assert gzip.decompress(b"".join(compressed)) == b"first\nsecond\n"
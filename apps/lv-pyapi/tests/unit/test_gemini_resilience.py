@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import gemini
+import pytest
+from google.genai import errors
+from metrics import gemini_hedge_wins_total, gemini_retries_total
+
+
+def api_error(code: int) -> errors.APIError:
+    return errors.APIError(code, {"error": {"message": "upstream", "status": "ERROR"}})
+
+
+async def test_retryable_errors_are_retried(monkeypatch):
+    calls = []
+
+    async def flaky_attempt(prompt, model, timeout):
+        calls.append(prompt)
+        if len(calls) == 1:
+            raise api_error(503)
+        return "ok"
+
+    monkeypatch.setattr(gemini, "_attempt", flaky_attempt)
+    monkeypatch.setattr(gemini, "GEMINI_RETRY_BASE_MS", 1)
+    retries_before = gemini_retries_total.value("503")
+    assert await gemini.generate_content("hi") == "ok"
+    assert len(calls) == 2
+    assert gemini_retries_total.value("503") == retries_before + 1
+
+
+async def test_client_errors_are_not_retried(monkeypatch):
+    calls = []
+
+    async def bad_request(prompt, model, timeout):
+        calls.append(prompt)
+        raise api_error(400)
+
+    monkeypatch.setattr(gemini, "_attempt", bad_request)
+    with pytest.raises(errors.APIError):
+        await gemini.generate_content("hi")
+    assert len(calls) == 1
+
+
+async def test_slow_request_is_hedged_and_loser_cancelled(monkeypatch):
+    calls = []
+    cancelled = []
+
+    async def straggler_then_fast(prompt, model, timeout):
+        calls.append(prompt)
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        return f"answer {len(calls)}"
+
+    tracker = gemini.LatencyTracker()
+    for _ in range(gemini.GEMINI_HEDGE_MIN_SAMPLES):
+        tracker.observe(0.01)
+    monkeypatch.setattr(gemini, "latency_tracker", tracker)
+    monkeypatch.setattr(gemini, "GEMINI_HEDGE_ENABLED", True)
+    monkeypatch.setattr(gemini, "GEMINI_HEDGE_MIN_DELAY_MS", 10)
+    monkeypatch.setattr(gemini, "_attempt", straggler_then_fast)
+    monkeypatch.setattr(gemini, "hedge_budget", gemini.HedgeBudget(ratio=1))
+    wins_before = gemini_hedge_wins_total.value()
+
+    result = await gemini.generate_content("hi", deadline=time.monotonic() + 2)
+    await asyncio.sleep(0)
+    assert result == "answer 2"
+    assert cancelled == [True]
+    assert gemini_hedge_wins_total.value() == wins_before + 1
+
+
+def test_hedge_budget_allows_only_a_share_of_requests():
+    budget = gemini.HedgeBudget(ratio=0.05, burst=5)
+    hedged = 0
+    for _ in range(200):
+        budget.deposit()
+        hedged += budget.try_spend()
+    assert hedged == 10
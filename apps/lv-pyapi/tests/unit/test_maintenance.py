@@ -0,0 +1,33 @@
+from datetime import date
+
+from maintenance import (PURGE_BASE_SLEEP_MS, PURGE_MAX_SLEEP_MS, add_months, expired_partitions, next_sleep,
+                         partition_name)
+
+BASE = PURGE_BASE_SLEEP_MS / 1000
+
+
+def test_sleep_backs_off_under_replication_lag_and_lock_waits():
+    pause = next_sleep(BASE, {"replication_lag": 60, "lock_waiters": 0})
+    assert pause == BASE * 2
+    pause = next_sleep(pause, {"replication_lag": 0, "lock_waiters": 3})
+    assert pause == BASE * 4
+    for _ in range(50):
+        pause = next_sleep(pause, {"replication_lag": 60, "lock_waiters": 0})
+    assert pause == PURGE_MAX_SLEEP_MS / 1000
+
+
+def test_sleep_recovers_towards_base_when_healthy():
+    pause = next_sleep(8 * BASE, {"replication_lag": 0, "lock_waiters": 0})
+    assert pause == 4 * BASE
+    for _ in range(10):
+        pause = next_sleep(pause, {"replication_lag": 0, "lock_waiters": 0})
+    assert pause == BASE
+
+
+def test_partitions_expire_only_once_their_whole_month_is_past_retention():
+    names = [partition_name(date(2025, month, 1)) for month in (8, 9, 10)] + ["ConversationMessage_default"]
+    assert partition_name(date(2025, 9, 1)) == "ConversationMessage_p202509"
+    assert add_months(date(2025, 11, 1), 3) == date(2026, 2, 1)
+    assert expired_partitions(names, date(2026, 10, 19), retention_months=12) == [
+        "ConversationMessage_p202508", "ConversationMessage_p202509"]
+    assert expired_partitions(names, date(2026, 10, 19), retention_months=0) == []
@@ -0,0 +1,33 @@
+from fastapi.testclient import TestClient
+from main import app
+from metrics import Counter, Histogram
+
+
+def test_counter_renders_prometheus_text():
+    counter = Counter("test_total", "Test counter", ("route",))
+    counter.inc("/a")
+    counter.inc("/a", amount=2)
+    assert counter.value("/a") == 3
+    assert 'test_total{route="/a"} 3' in counter.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Test histogram", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    rendered = histogram.render()
+    assert 'test_seconds_bucket{le="0.1"} 1' in rendered
+    assert 'test_seconds_bucket{le="1"} 2' in rendered
+    assert 'test_seconds_bucket{le="+Inf"} 3' in rendered
+    assert "test_seconds_count 3" in rendered
+
+
+def test_metrics_endpoint_reports_requests_by_route_template():
+    client = TestClient(app)
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'lv_pyapi_http_requests_total{method="GET",route="/health",status="200"}' in response.text
+    assert "lv_pyapi_http_request_duration_seconds_bucket" in response.text
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+from sqlalchemy.exc import OperationalError
+from starlette.requests import Request
+
+import database
+import main
+from database import READ_PRIMARY_COOKIE, ReplicaPool, RoutingSession, get_db, get_read_db
+from python_utils.sqlalchemy_models import User
+
+REPLICA_URLS = ["postgresql://replica-1/postgres", "postgresql://replica-2/postgres"]
+
+
+def test_round_robin_skips_unhealthy_replicas_and_fails_over_to_primary():
+    pool = ReplicaPool(REPLICA_URLS)
+    first, second = pool.replicas
+    assert {pool.choose(), pool.choose()} == {first.engine, second.engine}
+
+    first.healthy = False
+    assert pool.choose() is second.engine
+    second.healthy = False
+    assert pool.choose() is database.engine
+
+
+def test_reads_go_to_replica_until_the_session_writes(monkeypatch):
+    pool = ReplicaPool(REPLICA_URLS[:1])
+    monkeypatch.setattr(database, "replica_pool", pool)
+    session = RoutingSession(info={"request_state": SimpleNamespace()})
+
+    assert session.get_bind(clause=select(User)) is pool.replicas[0].engine
+    assert session.get_bind(clause=insert(User)) is database.engine
+    assert session.get_bind(clause=select(User)) is database.engine
+
+
+def test_write_elsewhere_in_the_request_pins_reads_to_primary(monkeypatch):
+    pool = ReplicaPool(REPLICA_URLS[:1])
+    monkeypatch.setattr(database, "replica_pool", pool)
+    state = SimpleNamespace(db_pinned=True)
+    session = RoutingSession(info={"request_state": state})
+    assert session.get_bind(clause=select(User)) is database.engine
+
+
+def make_request(cookie: str = "") -> Request:
+    return Request({"type": "http", "headers": [(b"cookie", cookie.encode())] if cookie else []})
+
+
+def test_orm_write_through_get_db_pins_the_request(monkeypatch):
+    monkeypatch.setattr(database, "engine", database.create_engine("postgresql://nowhere.invalid/postgres"))
+    request = make_request()
+    sessions = get_db(request)
+    db = next(sessions)
+    db.bind = database.engine
+    # The hook fires before the statement reaches the (unreachable) database
+    with pytest.raises(OperationalError):
+        db.execute(insert(User).values(email="pin@example.com"))
+    sessions.close()
+    assert request.state.db_pinned and request.state.db_wrote
+
+
+def test_write_sets_cookie_that_pins_the_clients_next_reads(monkeypatch):
+    async def fake_generate(prompt, deadline):
+        return "reply"
+
+    async def signed_in():
+        return "user-1"
+
+    monkeypatch.setattr(main.gemini, "generate_content", fake_generate)
+    monkeypatch.setattr(main.conversation_writer, "record_exchange", lambda *args: None)
+    main.app.dependency_overrides[main.get_optional_user] = signed_in
+    try:
+        response = TestClient(main.app).post("/api/gemini", json={"prompt": "hi"})
+    finally:
+        main.app.dependency_overrides.clear()
+    assert response.cookies.get(READ_PRIMARY_COOKIE) == "1"
+
+    pool = ReplicaPool(REPLICA_URLS[:1])
+    monkeypatch.setattr(database, "replica_pool", pool)
+    for cookie, expected in ((f"{READ_PRIMARY_COOKIE}=1", database.engine), ("", pool.replicas[0].engine)):
+        sessions = get_read_db(make_request(cookie))
+        assert next(sessions).get_bind(clause=select(User)) is expected
+        sessions.close()
@@ -0,0 +1,44 @@
+from fastapi.testclient import TestClient
+from main import app
+from slow_query import SlowQueryLog, is_analyzable, redact_parameters
+
+
+def test_parameters_are_redacted_to_type_names():
+    assert redact_parameters({"id_1": "secret", "limit": 10}) == {"id_1": "<str>", "limit": "<int>"}
+    assert redact_parameters(("secret",)) == ["<str>"]
+
+
+def test_only_plain_reads_are_analyzed():
+    assert is_analyzable('SELECT "User"."updatedAt" FROM "User" WHERE "User".id = %(id_1)s')
+    assert is_analyzable("WITH recent AS (SELECT 1) SELECT * FROM recent")
+    assert not is_analyzable('SELECT * FROM "ConversationStats" WHERE "userId" = %(id)s FOR UPDATE')
+    assert not is_analyzable("SELECT 1 FROM t FOR NO KEY UPDATE SKIP LOCKED")
+    assert not is_analyzable("WITH gone AS (DELETE FROM t RETURNING id) SELECT count(*) FROM gone")
+    assert not is_analyzable("SELECT pg_try_advisory_lock(%(id)s)")
+    assert not is_analyzable("SELECT * INTO copy FROM t")
+    assert not is_analyzable("UPDATE t SET x = 1")
+
+
+def test_ring_buffer_keeps_most_recent_entries():
+    log = SlowQueryLog("postgresql://unused", sample_rate=0, buffer_size=2, log_file=None)
+    for i in range(3):
+        log.record(f"SELECT {i}", None, 0.5)
+    recent = log.recent()
+    assert [entry["statement"] for entry in recent] == ["SELECT 2", "SELECT 1"]
+    assert recent[0]["explain_status"] == "skipped"
+    assert recent[0]["route"] == "<background>"
+
+
+def test_plans_are_captured_on_the_server_that_ran_the_statement(monkeypatch):
+    log = SlowQueryLog("postgresql://primary/postgres", sample_rate=1, log_file=None)
+    monkeypatch.setattr(log, "_ensure_worker", lambda: None)
+    log.record("SELECT 1", None, 0.5, database_url="postgresql://replica-1/postgres")
+    log.record("SELECT 2", None, 0.5)
+    assert [item[-1] for item in log._explain_queue.queue] == [
+        "postgresql://replica-1/postgres", "postgresql://primary/postgres"]
+
+
+def test_admin_endpoints_are_hidden_without_admin_key():
+    client = TestClient(app)
+    response = client.get("/admin/slow-queries")
+    assert response.status_code == 404
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from write_behind import ConversationWriter, Journal
+
+NOW = datetime(2026, 10, 19, 9, 30)
+
+
+def unavailable():
+    return OperationalError("INSERT", {}, Exception("connection refused"))
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.rows = {}
+        self.up = True
+        self.bad_users = set()
+
+    def write(self, rows):
+        if not self.up:
+            raise unavailable()
+        if any(row["userId"] in self.bad_users for row in rows):
+            raise IntegrityError("INSERT", {}, Exception("foreign key"))
+        for row in rows:
+            self.rows.setdefault(row["messageId"], row)
+
+
+def make_writer(tmp_path, db, **kwargs):
+    return ConversationWriter(journal=Journal(str(tmp_path / "journal.ndjson"), **kwargs), write=db.write)
+
+
+async def test_exchanges_are_queued_and_written_in_batches(tmp_path):
+    db = FakeDatabase()
+    writer = make_writer(tmp_path, db)
+    writer.record_exchange("user-1", "hello", NOW, "hi there", NOW)
+    writer.record_exchange("user-1", "again", NOW, "sure", NOW)
+    assert len(writer.pending) == 4 and not db.rows
+    await writer.flush()
+    assert [row["sender"] for row in db.rows.values()] == ["USER", "AI", "USER", "AI"]
+    assert writer.lag() == 0.0
+
+
+async def test_outage_spills_to_journal_and_recovery_replays_it(tmp_path):
+    db = FakeDatabase()
+    writer = make_writer(tmp_path, db)
+    db.up = False
+    writer.record_exchange("user-1", "hello", NOW, "hi there", NOW)
+    await writer.flush()
+    assert not db.rows and writer.journal.size() > 0
+
+    # A fresh writer, as after a restart, replays the journal
+    db.up = True
+    restarted = make_writer(tmp_path, db)
+    assert restarted.replay_journal() == 2
+    assert len(db.rows) == 2 and restarted.journal.size() == 0
+    # Replaying again writes nothing twice
+    restarted.journal.append(list(db.rows.values()))
+    restarted.replay_journal()
+    assert len(db.rows) == 2
+
+
+async def test_bad_rows_are_dropped_without_losing_the_batch(tmp_path):
+    db = FakeDatabase()
+    db.bad_users.add("deleted-user")
+    writer = make_writer(tmp_path, db)
+    writer.record_exchange("deleted-user", "hello", NOW, "hi", NOW)
+    writer.record_exchange("user-1", "hello", NOW, "hi", NOW)
+    await writer.flush()
+    assert {row["userId"] for row in db.rows.values()} == {"user-1"}
+    assert writer.journal.size() == 0
+
+
+def test_journal_is_bounded(tmp_path):
+    journal = Journal(str(tmp_path / "journal.ndjson"), max_bytes=200)
+    rows = [{"messageId": str(i), "content": "x" * 50} for i in range(10)]
+    kept = journal.append(rows)
+    assert 0 < kept < 10
+    assert journal.size() <= 200
@@ -0,0 +1,278 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, List, NamedTuple, Optional
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from starlette.concurrency import run_in_threadpool
+
+from database import engine
+from metrics import (write_behind_entries_total, write_behind_journal_bytes, write_behind_lag_seconds,
+                     write_behind_queue_depth, write_behind_write_lag)
+from python_utils.sqlalchemy_models import ConversationMessage, MessageSender
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "200"))
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_RETRY_S = float(os.getenv("WRITE_BEHIND_RETRY_S", "5"))
+WRITE_BEHIND_JOURNAL_PATH = os.getenv(
+    "WRITE_BEHIND_JOURNAL_PATH", os.path.join(tempfile.gettempdir(), "lv-pyapi-write-behind.ndjson"))
+WRITE_BEHIND_JOURNAL_MAX_BYTES = int(os.getenv("WRITE_BEHIND_JOURNAL_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+def message_row(user_id: str, sender: MessageSender, content: str, created_at: datetime) -> dict:
+    """A JSON-serialisable ConversationMessage row, with its id assigned up front so replays are idempotent"""
+    return {
+        "messageId": str(uuid.uuid4()),
+        "userId": user_id,
+        "sender": sender.value,
+        "content": content,
+        "createdAt": created_at.isoformat(),
+    }
+
+
+def insert_messages(rows: List[dict]) -> None:
+    """Insert rows in one transaction and one statement, skipping any already written"""
+    values = [
+        {**row, "sender": MessageSender(row["sender"]), "createdAt": datetime.fromisoformat(row["createdAt"])}
+        for row in rows
+    ]
+    with engine.begin() as conn:
+        conn.execute(
+            insert(ConversationMessage)
+            .values(values)
+            .on_conflict_do_nothing(index_elements=[ConversationMessage.messageId, ConversationMessage.createdAt])
+        )
+
+
+class Journal:
+    """
+    Bounded NDJSON file holding messages the database could not take.
+
+    Every operation takes an exclusive flock, so workers sharing the file
+    never interleave appends with a replay.
+    """
+
+    def __init__(self, path: str = WRITE_BEHIND_JOURNAL_PATH, max_bytes: int = WRITE_BEHIND_JOURNAL_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def append(self, rows: List[dict]) -> int:
+        """Append rows until the size bound is reached, returning how many were kept"""
+        kept = 0
+        with open(self.path, "a", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            for row in rows:
+                line = json.dumps(row) + "\n"
+                if size + len(line) > self.max_bytes:
+                    break
+                f.write(line)
+                size += len(line)
+                kept += 1
+            f.flush()
+            os.fsync(f.fileno())
+        return kept
+
+    def replay(self, write: Callable[[List[dict]], None], batch_size: int = WRITE_BEHIND_BATCH_SIZE) -> int:
+        """
+        Write every journaled row, then empty the journal.
+
+        If a write fails the journal is left intact; rows already written are
+        skipped on the next replay because inserts ignore known message ids.
+        """
+        if self.size() == 0:
+            return 0
+        with open(self.path, "r+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            rows = []
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # A torn final line from a crash mid-append
+                    logger.warning("Skipping unreadable write-behind journal line")
+            for start in range(0, len(rows), batch_size):
+                write(rows[start:start + batch_size])
+            f.truncate(0)
+        return len(rows)
+
+
+class PendingMessage(NamedTuple):
+    row: dict
+    enqueued_at: float
+
+
+class ConversationWriter:
+    """
+    Write-behind queue for conversation messages.
+
+    Handlers enqueue and return immediately; a background task drains the
+    queue in batched transactions. While the database is unreachable, or the
+    queue is full, messages go to the journal instead and are replayed once
+    writes succeed again or at the next startup.
+    """
+
+    def __init__(self, journal: Optional[Journal] = None, write: Callable[[List[dict]], None] = insert_messages,
+                 batch_size: int = WRITE_BEHIND_BATCH_SIZE, max_pending: int = WRITE_BEHIND_QUEUE_SIZE):
+        self.journal = journal or Journal()
+        self.write = write
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.pending: Deque[PendingMessage] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._retry_at = 0.0
+
+    def record_exchange(self, user_id: str, prompt: str, prompt_at: datetime, reply: str, reply_at: datetime) -> None:
+        """Queue a USER message and the AI reply to it"""
+        rows = [
+            message_row(user_id, MessageSender.USER, prompt, prompt_at),
+            message_row(user_id, MessageSender.AI, reply, reply_at),
+        ]
+        if len(self.pending) + len(rows) > self.max_pending:
+            # Journal in the thread pool so a full queue never blocks the event loop
+            asyncio.get_running_loop().run_in_executor(None, self._spill, rows)
+            return
+        now = time.monotonic()
+        self.pending.extend(PendingMessage(row, now) for row in rows)
+        self._wakeup.set()
+
+    def lag(self) -> float:
+        """Seconds the oldest queued message has been waiting"""
+        return time.monotonic() - self.pending[0].enqueued_at if self.pending else 0.0
+
+    def _spill(self, rows: List[dict]) -> None:
+        try:
+            kept = self.journal.append(rows)
+        except OSError:
+            logger.exception("Could not write to the write-behind journal")
+            kept = 0
+        write_behind_entries_total.inc("spilled", amount=kept)
+        if kept < len(rows):
+            write_behind_entries_total.inc("dropped", amount=len(rows) - kept)
+            logger.error(f"Write-behind journal full, dropped {len(rows) - kept} conversation messages")
+
+    def write_batch(self, batch: List[PendingMessage]) -> None:
+        """Write one batch, journaling it if the database is unavailable"""
+        rows = [pending.row for pending in batch]
+        if time.monotonic() < self._retry_at:
+            self._spill(rows)
+            return
+        try:
+            self.write(rows)
+            written = batch
+        except (OperationalError, InterfaceError) as e:
+            self._unavailable(rows, e)
+            return
+        except Exception:
+            # One bad row, e.g. for a deleted user, must not sink the rest of the batch
+            written = self._write_individually(batch)
+
+        now = time.monotonic()
+        for pending in written:
+            write_behind_write_lag.observe(now - pending.enqueued_at)
+        write_behind_entries_total.inc("written", amount=len(written))
+        # The database is reachable again, so catch up on anything journaled meanwhile
+        if self.journal.size() and time.monotonic() >= self._retry_at:
+            try:
+                self.replay_journal()
+            except Exception as e:
+                logger.warning(f"Could not replay write-behind journal: {e}")
+
+    def _unavailable(self, rows: List[dict], error: Exception) -> None:
+        logger.warning(f"Database unavailable, journaling {len(rows)} conversation messages: {error}")
+        self._retry_at = time.monotonic() + WRITE_BEHIND_RETRY_S
+        self._spill(rows)
+
+    def _write_individually(self, batch: List[PendingMessage]) -> List[PendingMessage]:
+        written = []
+        for index, pending in enumerate(batch):
+            try:
+                self.write([pending.row])
+            except (OperationalError, InterfaceError) as e:
+                self._unavailable([other.row for other in batch[index:]], e)
+                break
+            except Exception:
+                write_behind_entries_total.inc("dropped")
+                logger.exception("Dropping conversation message that could not be written")
+            else:
+                written.append(pending)
+        return written
+
+    def _write_replayed(self, rows: List[dict]) -> None:
+        try:
+            self.write(rows)
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception:
+            # Rows that can never be written must not block the rest of the journal
+            for row in rows:
+                try:
+                    self.write([row])
+                except (OperationalError, InterfaceError):
+                    raise
+                except Exception:
+                    write_behind_entries_total.inc("dropped")
+                    logger.exception("Dropping journaled conversation message that could not be written")
+
+    def replay_journal(self) -> int:
+        replayed = self.journal.replay(self._write_replayed, self.batch_size)
+        if replayed:
+            write_behind_entries_total.inc("replayed", amount=replayed)
+            logger.info(f"Replayed {replayed} journaled conversation messages")
+        return replayed
+
+    async def run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Give concurrent handlers a moment to fill the batch
+            await asyncio.sleep(WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        while self.pending:
+            batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+            try:
+                await run_in_threadpool(self.write_batch, batch)
+            except Exception:
+                logger.exception("Write-behind batch failed")
+                await run_in_threadpool(self._spill, [pending.row for pending in batch])
+
+    async def start(self) -> None:
+        """Replay what the last run journaled, then start draining"""
+        try:
+            await run_in_threadpool(self.replay_journal)
+        except Exception as e:
+            logger.warning(f"Could not replay write-behind journal at startup: {e}")
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Stop draining and write, or journal, whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+conversation_writer = ConversationWriter()
+write_behind_queue_depth.set_function(lambda: len(conversation_writer.pending))
+write_behind_lag_seconds.set_function(conversation_writer.lag)
+write_behind_journal_bytes.set_function(conversation_writer.journal.size)
@@ -1,6 +1,20 @@
-import { NextResponse } from 'next/server';
+import { PYAPI_URL } from '@/config';
+import { NextRequest, NextResponse } from 'next/server';
+
+export async function GET(request: NextRequest) {
+  // Revoke the session in PyAPI while the cookie is still here, so its auth
+  // cache stops accepting the token
+  if (PYAPI_URL) {
+    try {
+      await fetch(`${PYAPI_URL}/auth/logout`, {
+        method: 'POST',
+        headers: { cookie: request.headers.get('cookie') ?? '' },
+      });
+    } catch (error) {
+      console.error('Failed to revoke PyAPI session:', error);
+    }
+  }
 
-export async function GET() {
   const response = NextResponse.json({ success: true });
 
   // Clear all NextAuth related cookies (both prod and dev versions)
@@ -2,7 +2,7 @@
 
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
-import { PyAPIHealthResponse, checkHealth, getHello } from '@/lib/services/pyapi';
+import { PyAPIHealthResponse, checkHealth, getHello, logout } from '@/lib/services/pyapi';
 import { signOut, useSession } from 'next-auth/react';
 import Link from 'next/link';
 import { useRouter } from 'next/navigation';
@@ -46,6 +46,16 @@ export default function DashboardPage() {
     }
   }, [session]);
 
+  const handleSignOut = async () => {
+    try {
+      await logout();
+    } catch (error) {
+      // Signing out of the web app must not depend on PyAPI being reachable
+      console.error('Failed to revoke PyAPI session:', error);
+    }
+    await signOut({ callbackUrl: '/login' });
+  };
+
   if (status === 'loading') {
     return (
       <div className="min-h-screen flex items-center justify-center">
@@ -71,7 +81,7 @@ export default function DashboardPage() {
               <span className="text-sm text-gray-700">
                 Welcome, {session.user?.name || session.user?.email}
               </span>
-              <Button onClick={() => signOut({ callbackUrl: '/login' })} variant="outline">
+              <Button onClick={handleSignOut} variant="outline">
                 Sign Out
               </Button>
             </div>
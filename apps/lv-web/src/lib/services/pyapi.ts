@@ -32,18 +32,33 @@ export async function getHello(): Promise<{ message: string }> {
 }
 
 export async function getUser(userId: string): Promise<PyAPIUser> {
-  const response = await fetch(`${getBaseUrl()}/users/${userId}`);
+  const response = await fetch(`${getBaseUrl()}/users/${userId}`, {
+    credentials: 'include',
+  });
   if (!response.ok) {
     throw new Error(`Failed to fetch user: ${response.statusText}`);
   }
   return response.json();
 }
 
+// Revokes the session in PyAPI while the cookie still authenticates the call;
+// run it before NextAuth's signOut clears the cookie.
+export async function logout(): Promise<void> {
+  const response = await fetch(`${getBaseUrl()}/auth/logout`, {
+    method: 'POST',
+    credentials: 'include',
+  });
+  if (!response.ok) {
+    throw new Error(`PyAPI logout failed: ${response.statusText}`);
+  }
+}
+
 export async function getGeminiResponse(
   userMessage: string
 ): Promise<{ message: string; status: number }> {
   const response = await fetch(`${getBaseUrl()}/api/gemini`, {
     method: 'POST',
+    credentials: 'include',
     headers: {
       'Content-Type': 'application/json',
     },
@@ -52,3 +67,38 @@ export async function getGeminiResponse(
 
   return response.json();
 }
+
+export type ChatServerFrame =
+  | { type: 'token'; content: string }
+  | { type: 'done' }
+  | { type: 'ping' }
+  | { type: 'pong' }
+  | { type: 'error'; status: number; message: string; retryAfter?: number };
+
+export interface ChatSocket {
+  send: (content: string) => void;
+  close: () => void;
+}
+
+// Opens the /ws/chat channel. The NextAuth session cookie authenticates the
+// handshake, and heartbeat pings are answered here so callers only see
+// token, done and error frames.
+export function openChatSocket(onFrame: (frame: ChatServerFrame) => void): ChatSocket {
+  const url = new URL('/ws/chat', getBaseUrl() || window.location.origin);
+  url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:';
+  const socket = new WebSocket(url);
+
+  socket.onmessage = (event) => {
+    const frame = JSON.parse(event.data) as ChatServerFrame;
+    if (frame.type === 'ping') {
+      socket.send(JSON.stringify({ type: 'pong' }));
+      return;
+    }
+    onFrame(frame);
+  };
+
+  return {
+    send: (content: string) => socket.send(JSON.stringify({ type: 'message', content })),
+    close: () => socket.close(),
+  };
+}
@@ -0,0 +1,5 @@
+-- CreateIndex
+CREATE INDEX "Session_expires_idx" ON "public"."Session"("expires");
+
+-- CreateIndex
+CREATE INDEX "VerificationToken_expires_idx" ON "public"."VerificationToken"("expires");
@@ -0,0 +1,123 @@
+-- CreateTable
+CREATE TABLE "public"."ConversationStats" (
+    "userId" UUID NOT NULL,
+    "userMessageCount" INTEGER NOT NULL DEFAULT 0,
+    "aiMessageCount" INTEGER NOT NULL DEFAULT 0,
+    "totalCharacters" BIGINT NOT NULL DEFAULT 0,
+    "lastMessageAt" TIMESTAMP(3),
+    "updatedAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "ConversationStats_pkey" PRIMARY KEY ("userId")
+);
+
+-- AddForeignKey
+ALTER TABLE "public"."ConversationStats" ADD CONSTRAINT "ConversationStats_userId_fkey" FOREIGN KEY ("userId") REFERENCES "public"."User"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- Keep ConversationStats current from ConversationMessage writes.
+-- Statement-level triggers with transition tables aggregate a whole batch
+-- into one upsert per user, and rows are touched in "userId" order so
+-- concurrent writers and the backfill job can't deadlock.
+CREATE FUNCTION "public"."conversation_stats_after_insert"() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO "public"."ConversationStats" AS s
+        ("userId", "userMessageCount", "aiMessageCount", "totalCharacters", "lastMessageAt", "updatedAt")
+    SELECT "userId",
+           count(*) FILTER (WHERE "sender" = 'USER'),
+           count(*) FILTER (WHERE "sender" = 'AI'),
+           sum(length("content")),
+           max("createdAt"),
+           now()
+    FROM new_rows
+    GROUP BY "userId"
+    ORDER BY "userId"
+    ON CONFLICT ("userId") DO UPDATE SET
+        "userMessageCount" = s."userMessageCount" + EXCLUDED."userMessageCount",
+        "aiMessageCount" = s."aiMessageCount" + EXCLUDED."aiMessageCount",
+        "totalCharacters" = s."totalCharacters" + EXCLUDED."totalCharacters",
+        "lastMessageAt" = GREATEST(s."lastMessageAt", EXCLUDED."lastMessageAt"),
+        "updatedAt" = EXCLUDED."updatedAt";
+    RETURN NULL;
+END;
+$$;
+
+CREATE FUNCTION "public"."conversation_stats_after_update"() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE "public"."ConversationStats" AS s SET
+        "userMessageCount" = s."userMessageCount" + d.user_delta,
+        "aiMessageCount" = s."aiMessageCount" + d.ai_delta,
+        "totalCharacters" = s."totalCharacters" + d.character_delta,
+        "lastMessageAt" = GREATEST(s."lastMessageAt", d.newest),
+        "updatedAt" = now()
+    FROM (
+        SELECT "userId",
+               sum(user_delta) AS user_delta,
+               sum(ai_delta) AS ai_delta,
+               sum(character_delta) AS character_delta,
+               max(newest) AS newest
+        FROM (
+            SELECT "userId",
+                   (CASE WHEN "sender" = 'USER' THEN 1 ELSE 0 END) AS user_delta,
+                   (CASE WHEN "sender" = 'AI' THEN 1 ELSE 0 END) AS ai_delta,
+                   length("content") AS character_delta,
+                   "createdAt" AS newest
+            FROM new_rows
+            UNION ALL
+            SELECT "userId",
+                   -(CASE WHEN "sender" = 'USER' THEN 1 ELSE 0 END),
+                   -(CASE WHEN "sender" = 'AI' THEN 1 ELSE 0 END),
+                   -length("content"),
+                   NULL
+            FROM old_rows
+        ) AS changes
+        GROUP BY "userId"
+    ) AS d
+    WHERE s."userId" = d."userId";
+    RETURN NULL;
+END;
+$$;
+
+CREATE FUNCTION "public"."conversation_stats_after_delete"() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE "public"."ConversationStats" AS s SET
+        "userMessageCount" = s."userMessageCount" - d.user_count,
+        "aiMessageCount" = s."aiMessageCount" - d.ai_count,
+        "totalCharacters" = s."totalCharacters" - d.characters,
+        -- Only rescan when the newest message itself was deleted
+        "lastMessageAt" = CASE
+            WHEN d.newest_deleted >= s."lastMessageAt" THEN (
+                SELECT max(m."createdAt") FROM "public"."ConversationMessage" m WHERE m."userId" = s."userId"
+            )
+            ELSE s."lastMessageAt"
+        END,
+        "updatedAt" = now()
+    FROM (
+        SELECT "userId",
+               count(*) FILTER (WHERE "sender" = 'USER') AS user_count,
+               count(*) FILTER (WHERE "sender" = 'AI') AS ai_count,
+               sum(length("content")) AS characters,
+               max("createdAt") AS newest_deleted
+        FROM old_rows
+        GROUP BY "userId"
+    ) AS d
+    WHERE s."userId" = d."userId";
+    RETURN NULL;
+END;
+$$;
+
+-- CreateTrigger
+CREATE TRIGGER "ConversationMessage_stats_insert"
+    AFTER INSERT ON "public"."ConversationMessage"
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION "public"."conversation_stats_after_insert"();
+
+-- CreateTrigger
+CREATE TRIGGER "ConversationMessage_stats_update"
+    AFTER UPDATE ON "public"."ConversationMessage"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION "public"."conversation_stats_after_update"();
+
+-- CreateTrigger
+CREATE TRIGGER "ConversationMessage_stats_delete"
+    AFTER DELETE ON "public"."ConversationMessage"
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION "public"."conversation_stats_after_delete"();
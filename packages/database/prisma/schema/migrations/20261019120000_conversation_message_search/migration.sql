@@ -0,0 +1,6 @@
+-- AlterTable
+-- Adding a stored generated column rewrites the table; run during a quiet period
+ALTER TABLE "public"."ConversationMessage" ADD COLUMN "searchVector" tsvector GENERATED ALWAYS AS (to_tsvector('english'::regconfig, "content")) STORED;
+
+-- CreateIndex
+CREATE INDEX "ConversationMessage_searchVector_idx" ON "public"."ConversationMessage" USING GIN ("searchVector");
@@ -0,0 +1,5 @@
+-- DropIndex
+DROP INDEX "public"."ConversationMessage_userId_idx";
+
+-- CreateIndex
+CREATE INDEX "ConversationMessage_userId_createdAt_idx" ON "public"."ConversationMessage"("userId", "createdAt");
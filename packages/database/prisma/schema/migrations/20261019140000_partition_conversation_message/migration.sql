@@ -0,0 +1,81 @@
+-- Convert ConversationMessage to monthly range partitions on "createdAt".
+-- The rows are copied into the new table, so run this during a maintenance window.
+-- Afterwards the lv-pyapi maintenance job creates future partitions and retires expired ones.
+
+-- Move the existing table out of the way, freeing its index names
+ALTER TABLE "public"."ConversationMessage" RENAME TO "ConversationMessage_unpartitioned";
+ALTER INDEX "public"."ConversationMessage_pkey" RENAME TO "ConversationMessage_unpartitioned_pkey";
+ALTER INDEX "public"."ConversationMessage_userId_createdAt_idx" RENAME TO "ConversationMessage_unpartitioned_userId_createdAt_idx";
+ALTER INDEX "public"."ConversationMessage_searchVector_idx" RENAME TO "ConversationMessage_unpartitioned_searchVector_idx";
+
+-- CreateTable
+-- The primary key has to include the partition key
+CREATE TABLE "public"."ConversationMessage" (
+    "messageId" UUID NOT NULL DEFAULT gen_random_uuid(),
+    "userId" UUID NOT NULL,
+    "sender" "MessageSender" NOT NULL,
+    "content" TEXT NOT NULL,
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "searchVector" tsvector GENERATED ALWAYS AS (to_tsvector('english'::regconfig, "content")) STORED,
+
+    CONSTRAINT "ConversationMessage_pkey" PRIMARY KEY ("messageId", "createdAt")
+) PARTITION BY RANGE ("createdAt");
+
+-- One partition per month from the oldest message to three months ahead
+DO $$
+DECLARE
+    month_start DATE;
+    last_month DATE := date_trunc('month', now() + interval '3 months')::date;
+BEGIN
+    SELECT COALESCE(date_trunc('month', min("createdAt")), date_trunc('month', now()))::date
+    INTO month_start
+    FROM "public"."ConversationMessage_unpartitioned";
+
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE "public".%I PARTITION OF "public"."ConversationMessage" FOR VALUES FROM (%L) TO (%L)',
+            'ConversationMessage_p' || to_char(month_start, 'YYYYMM'),
+            month_start,
+            (month_start + interval '1 month')::date
+        );
+        month_start := (month_start + interval '1 month')::date;
+    END LOOP;
+END;
+$$;
+
+-- Catches rows beyond the newest partition if maintenance falls behind
+CREATE TABLE "public"."ConversationMessage_default" PARTITION OF "public"."ConversationMessage" DEFAULT;
+
+-- Copy the rows before the stats triggers exist, since ConversationStats already counts them
+INSERT INTO "public"."ConversationMessage" ("messageId", "userId", "sender", "content", "createdAt")
+SELECT "messageId", "userId", "sender", "content", "createdAt"
+FROM "public"."ConversationMessage_unpartitioned";
+
+DROP TABLE "public"."ConversationMessage_unpartitioned";
+
+-- CreateIndex
+CREATE INDEX "ConversationMessage_userId_createdAt_idx" ON "public"."ConversationMessage"("userId", "createdAt");
+
+-- CreateIndex
+CREATE INDEX "ConversationMessage_searchVector_idx" ON "public"."ConversationMessage" USING GIN ("searchVector");
+
+-- AddForeignKey
+ALTER TABLE "public"."ConversationMessage" ADD CONSTRAINT "ConversationMessage_userId_fkey" FOREIGN KEY ("userId") REFERENCES "public"."User"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- CreateTrigger
+CREATE TRIGGER "ConversationMessage_stats_insert"
+    AFTER INSERT ON "public"."ConversationMessage"
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION "public"."conversation_stats_after_insert"();
+
+-- CreateTrigger
+CREATE TRIGGER "ConversationMessage_stats_update"
+    AFTER UPDATE ON "public"."ConversationMessage"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION "public"."conversation_stats_after_update"();
+
+-- CreateTrigger
+CREATE TRIGGER "ConversationMessage_stats_delete"
+    AFTER DELETE ON "public"."ConversationMessage"
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION "public"."conversation_stats_after_delete"();
@@ -1,5 +1,5 @@
-from sqlalchemy import String, DateTime, Boolean, Integer, BigInteger, ForeignKey, ForeignKeyConstraint, Table, ARRAY, Text, Float, Enum, text, func, event
-from sqlalchemy.dialects.postgresql import UUID as PostgresUUID, TIMESTAMP, DOUBLE_PRECISION, ENUM
+from sqlalchemy import String, DateTime, Boolean, Integer, BigInteger, ForeignKey, ForeignKeyConstraint, Table, ARRAY, Text, Float, Enum, Computed, text, func, event
+from sqlalchemy.dialects.postgresql import UUID as PostgresUUID, TIMESTAMP, DOUBLE_PRECISION, ENUM, TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, relationship, Mapped, mapped_column, Mapper
 from sqlalchemy.types import TypeDecorator
 from uuid import UUID
@@ -8,6 +8,13 @@ from datetime import datetime
 import enum
 
 
+# Enum Classes
+
+class MessageSender(enum.Enum):
+    """Enum type for MessageSender"""
+    USER = 'USER'
+    AI = 'AI'
+
 # Base Class
 class Base(DeclarativeBase):
     pass
@@ -71,6 +78,45 @@ class Authenticator(Base):
     user: Mapped["User"] = relationship("User", back_populates="authenticator", uselist=False)
 
 
+class ConversationMessage(Base):
+    __tablename__ = "ConversationMessage"
+    __table_args__ = {'schema': 'public'}
+
+    messageId: Mapped[UUID] = mapped_column(PostgresUUID(as_uuid=True), primary_key=True, nullable=False, server_default=text("gen_random_uuid()"))
+    userId: Mapped[UUID] = mapped_column(PostgresUUID(as_uuid=True), ForeignKey("public.User.id"), nullable=False)
+    sender: Mapped[MessageSender] = mapped_column(Enum(MessageSender), nullable=False)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    createdAt: Mapped[datetime] = mapped_column(TIMESTAMP, primary_key=True, nullable=False, server_default=func.now())
+    searchVector: Mapped[Optional[str]] = mapped_column(TSVECTOR, Computed("to_tsvector('english'::regconfig, content)", persisted=True), nullable=True)
+
+    # Relationships
+    user: Mapped["User"] = relationship("User", back_populates="conversationMessage", uselist=False)
+
+
+class ConversationStats(Base):
+    __tablename__ = "ConversationStats"
+    __table_args__ = {'schema': 'public'}
+
+    userId: Mapped[UUID] = mapped_column(PostgresUUID(as_uuid=True), ForeignKey("public.User.id"), primary_key=True, nullable=False, server_default=text("gen_random_uuid()"))
+    userMessageCount: Mapped[int] = mapped_column(Integer, nullable=False)
+    aiMessageCount: Mapped[int] = mapped_column(Integer, nullable=False)
+    totalCharacters: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    lastMessageAt: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP, nullable=True)
+    updatedAt: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=False, server_default=func.now(), onupdate=func.now())
+
+    # Relationships
+    user: Mapped["User"] = relationship("User", back_populates="conversationStats", uselist=False)
+
+
+class RateLimitCounter(Base):
+    __tablename__ = "RateLimitCounter"
+    __table_args__ = {'schema': 'public'}
+
+    key: Mapped[str] = mapped_column(Text, primary_key=True, nullable=False)
+    windowStart: Mapped[datetime] = mapped_column(TIMESTAMP, primary_key=True, nullable=False)
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
 class Session(Base):
     __tablename__ = "Session"
     __table_args__ = {'schema': 'public'}
@@ -107,6 +153,8 @@ class User(Base):
     account: Mapped[List["Account"]] = relationship("Account", back_populates="user")
     session: Mapped[List["Session"]] = relationship("Session", back_populates="user")
     authenticator: Mapped[List["Authenticator"]] = relationship("Authenticator", back_populates="user")
+    conversationMessage: Mapped[List["ConversationMessage"]] = relationship("ConversationMessage", back_populates="user")
+    conversationStats: Mapped[List["ConversationStats"]] = relationship("ConversationStats", back_populates="user")
 
 class Vector(TypeDecorator):
     """Custom type for PostgreSQL vector type"""
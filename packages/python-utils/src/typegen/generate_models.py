@@ -8,8 +8,8 @@ from typing import Any, Dict, List, Optional, Sequence, Tuple, Type, Union
 from uuid import UUID
 
 from sqlalchemy import (ARRAY, BigInteger, Boolean, Column, Integer, MetaData, String,
-                        Table, Text, UniqueConstraint, ForeignKey, ForeignKeyConstraint)
-from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION, TIMESTAMP
+                        Table, Text, UniqueConstraint, ForeignKey, ForeignKeyConstraint, text)
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION, TIMESTAMP, TSVECTOR
 from sqlalchemy.dialects.postgresql import UUID as PostgresUUID
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.types import TypeDecorator
@@ -51,6 +51,7 @@ type_map: Dict[str, Tuple[Type, Any]] = {
     'VARCHAR': (str, String),
     'ARRAY': (List[str], ARRAY(Text)),
     'vector': (str, Vector()),
+    'TSVECTOR': (str, TSVECTOR),
     'NULL': (str, Text),  # Changed from NULL to Text as a fallback
 }
 
@@ -182,7 +183,17 @@ def generate_models_manually(db_url, output_file):
     
     engine = create_engine(db_url)
     metadata = MetaData()
-    metadata.reflect(bind=engine, extend_existing=True)
+
+    # Partitions of a partitioned table are reflected as tables of their own;
+    # skip them so only the partitioned parent gets a model
+    with engine.connect() as conn:
+        partitions = set(conn.execute(text('''
+            SELECT c.relname
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relispartition AND n.nspname = current_schema()
+        ''')).scalars())
+    metadata.reflect(bind=engine, extend_existing=True, only=lambda table_name, _: table_name not in partitions)
     
     # --- NEW: Extract enum column defaults from the database ---
     enum_column_defaults = {}  # {table.column: default_value}
@@ -275,8 +286,8 @@ def generate_models_manually(db_url, output_file):
         print(f"Warning: Could not extract enum types: {e}")
     
     # Generate the header with all necessary imports
-    header = '''from sqlalchemy import String, DateTime, Boolean, Integer, BigInteger, ForeignKey, ForeignKeyConstraint, Table, ARRAY, Text, Float, Enum, text, func, event
-from sqlalchemy.dialects.postgresql import UUID as PostgresUUID, TIMESTAMP, DOUBLE_PRECISION, ENUM
+    header = '''from sqlalchemy import String, DateTime, Boolean, Integer, BigInteger, ForeignKey, ForeignKeyConstraint, Table, ARRAY, Text, Float, Enum, Computed, text, func, event
+from sqlalchemy.dialects.postgresql import UUID as PostgresUUID, TIMESTAMP, DOUBLE_PRECISION, ENUM, TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, relationship, Mapped, mapped_column, Mapper
 from sqlalchemy.types import TypeDecorator
 from uuid import UUID
@@ -579,11 +590,19 @@ class {class_name}(Base):
             elif col_type == 'DOUBLE PRECISION':
                 python_type = 'float'
                 sql_type = 'DOUBLE_PRECISION'
+            # Handle full-text search vectors
+            elif col_type == 'TSVECTOR':
+                python_type = 'str'
+                sql_type = 'TSVECTOR'
             # Handle other types
             else:
                 python_type = 'str'
                 sql_type = 'Text'
             
+            # Generated columns are computed by Postgres and must never be written
+            if column.computed is not None:
+                sql_type += f', Computed({str(column.computed.sqltext)!r}, persisted=True)'
+            
             # Add Optional[] if nullable
             if column.nullable:
                 python_type = f'Optional[{python_type}]'